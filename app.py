@@ -1,37 +1,61 @@
 #!/usr/bin/env python
 
-from flask import Flask, request
-
 from bot import bot
-from mud import Chatflow
-from storage import Storage
+from storage import Storage, IdleClock
 
 import settings
 
 
-app = Flask(__name__)
-bot.set_webhook(
-    url=f"https://{settings.WEBHOOK_HOST}/{settings.TOKEN}",
-    certificate=open(settings.CERT, 'rb'))
-
-
-@app.route('/' + settings.TOKEN, methods=['POST'])
 def webhook():
+    from flask import request
+
     bot_request = bot.get_player_bot_request(request)
     if bot_request:
         storage = Storage(bot_request.send_callback_factory, cmd_pfx=bot.cmd_pfx)
         player = storage.get_player_state(bot_request.chatkey)
-        chatflow = Chatflow(player, storage.world, bot.cmd_pfx)
+        chatflow = player.get_mutator(storage.world)
         if bot_request.process_message(chatflow):  # bot-specific UI commands
             storage.release()
+            bot_request.prepare_messages()
+            bot_request.session.flush()
         else:
             chatflow.process_message(bot_request.message_text)
-            storage.save()
+            bot_request.prepare_messages()
+            storage.save(bot_request.session)
         bot_request.send_messages()
     return b'OK'
 
 
+def create_app():
+    from flask import Flask
+
+    flask_app = Flask(__name__)
+    flask_app.add_url_rule('/' + settings.TOKEN, 'webhook', webhook, methods=['POST'])
+    return flask_app
+
+
+class LazyApp(object):
+    """
+    WSGI application that imports flask and creates the actual application on the first request, so that workers
+    start fast. The webhook is registered once with `python bot.py set_webhook`, not by every worker.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.app = None
+
+    def __call__(self, environ, start_response):
+        if self.app is None:
+            self.app = self.factory()
+        return self.app(environ, start_response)
+
+
+app = LazyApp(create_app)
+
+
 def enact(*args):
+    if IdleClock().skip_tick(settings.IDLE_STEP):
+        return
     bot_request = bot.get_bot_request()
     storage = Storage(bot_request.send_callback_factory, cmd_pfx=bot.cmd_pfx)
     storage.world.enact()
@@ -46,3 +70,7 @@ except ImportError:
 else:
     uwsgi.register_signal(30, "worker", enact)
     uwsgi.add_timer(30, settings.CYCLE_SECONDS)
+
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
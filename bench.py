@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import sys
+import tracemalloc
+from timeit import timeit
+
+from mud.player import CommandPrefix
+from mud.locations import Field
+from mud.commodities import Vegetable, Mushroom, Cotton, Spindle
+from mud.npcs import PeasantState
+from mud.player import PlayerState
+from mud.utils import pretty_list
+from test import MockRedis
+from storage import Storage
+from migrate import migrations
+
+
+benchmarks = list()
+
+
+def benchmark(f):
+    benchmarks.append(f)
+    return f
+
+
+def null_send_callback_factory(chatkey):
+    return lambda message: None
+
+
+def get_world(n_players=5):
+    cmd_pfx = CommandPrefix('/')
+    storage = Storage(null_send_callback_factory, redis=MockRedis(), cmd_pfx=cmd_pfx)
+    for migrate in migrations:
+        migrate(storage)
+
+    players = []
+    for chatkey in range(n_players):
+        player = storage.get_player_state(chatkey)
+        player.name = f"Player {chatkey}"
+        player.bag.update([Vegetable(), Mushroom()])
+        player.get_mutator(storage.world).spawn(Field)
+        players.append(player)
+
+    return storage, players
+
+
+def measure(f, n):
+    """
+    Returns average traced bytes peak and number of blocks left allocated per call of f.
+    """
+    peak = blocks = 0
+    for _ in range(n):
+        tracemalloc.clear_traces()
+        f()
+        snapshot = tracemalloc.take_snapshot()
+        blocks += sum(stat.count for stat in snapshot.statistics('filename'))
+        current, cur_peak = tracemalloc.get_traced_memory()
+        peak += cur_peak
+    return peak / n, blocks / n
+
+
+def report(name, peak, blocks):
+    print(f"{name:<40}{peak / 1024:>10.1f} KiB peak{blocks:>10.1f} blocks")
+
+
+@benchmark
+def allocations(n=200):
+    storage, players = get_world()
+    world = storage.world
+    player = players[0]
+
+    # warm up
+    for _ in range(10):
+        world.enact()
+        player.get_mutator(world).process_message('/where')
+
+    tracemalloc.start()
+    report("tick", *measure(world.enact, n))
+    report("/where", *measure(lambda: player.get_mutator(world).process_message('/where'), n))
+
+    def go_and_back():
+        player.get_mutator(world).process_message('/north')
+        player.get_mutator(world).process_message('/south')
+
+    report("/north + /south", *measure(go_and_back, n))
+    tracemalloc.stop()
+
+
+@benchmark
+def fungibles(n=1000):
+    storage, players = get_world(n_players=1)
+    player, = players
+    player.bag.update(Vegetable() for _ in range(n))
+    player.bag.update(Cotton() for _ in range(n // 10))
+
+    tracemalloc.start()
+    tracemalloc.clear_traces()
+    storage.save()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{'bag size':<40}{len(player.bag):>10d}")
+    print(f"{'redis keys':<40}{len(storage.redis.dict):>10d}")
+    print(f"{'player blob':<40}{len(storage.redis.get(storage._player_key % 0)):>10d} bytes")
+    print(f"{'save':<40}{peak / 1024:>10.1f} KiB peak")
+    print(f"{'pretty_list(bag)':<40}{timeit(lambda: pretty_list(player.bag), number=100) * 10:>10.3f} ms")
+
+
+@benchmark
+def objects(n=1000):
+    factories = (
+        ('Vegetable', Vegetable),
+        ('Spindle', Spindle),
+        ('PeasantState', PeasantState),
+        ('PlayerState', lambda: PlayerState(None, CommandPrefix('/'))))
+
+    tracemalloc.start()
+    for name, factory in factories:
+        tracemalloc.clear_traces()
+        objects = [factory() for _ in range(n)]
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"{name:<40}{current / n:>10.1f} bytes per object")
+        del objects
+    tracemalloc.stop()
+
+    veg, spindle, peasant = Vegetable(), Spindle(), PeasantState()
+    accesses = (
+        ('Vegetable.name', lambda: veg.name),
+        ('Vegetable.icon', lambda: veg.icon),
+        ('Spindle.descr', lambda: spindle.descr),
+        ('PeasantState.descr', lambda: peasant.descr),
+        ('pretty_list([veg, spindle])', lambda: pretty_list([veg, spindle])))
+    for name, f in accesses:
+        print(f"{name:<40}{timeit(f, number=100000) * 10:>10.3f} us")
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for f in benchmarks:
+        if not names or f.__name__ in names:
+            print(f"# {f.__name__}")
+            f()
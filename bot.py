@@ -1,16 +1,17 @@
 from collections import defaultdict
+from hashlib import md5
 
 from mud.player import CommandPrefix
+from mud.utils import digest
 from storage import PlayerSessionsStorage
 import settings
 
-import telegram
-
 
 class BotRequest(object):
     def __init__(self, bot):
         self.bot = bot
         self.message_queue = defaultdict(list)
+        self.prepared = None
 
     def send_callback_factory(self, chatkey):
         def callback(msg):
@@ -20,11 +21,17 @@ class BotRequest(object):
     def get_send_message_args(self):
         while self.message_queue:
             chatkey, messages = self.message_queue.popitem()
-            text = "\n\n".join(messages)
+            text = "\n\n".join(digest(messages))
             yield dict(chat_id=chatkey, text=text)
 
+    def prepare_messages(self):
+        """
+        Builds messages ahead of sending them, so that whatever building them changes can be saved first.
+        """
+        self.prepared = list(self.get_send_message_args())
+
     def send_messages(self):
-        for args in self.get_send_message_args():
+        for args in self.get_send_message_args() if self.prepared is None else self.prepared:
             self.bot.sendMessage(parse_mode="Markdown", **args)
 
 
@@ -37,12 +44,15 @@ class PlayerBotRequest(BotRequest):
         ('general', '…')
     )
 
+    keyboards = {}  # (category, commands fingerprint) -> (hash, markup), shared by requests of a process
+
     def __init__(self, bot, message, session, cmd_pfx):
         super().__init__(bot)
         self.message = message
         self.session = session
         self.cmd_pfx = cmd_pfx
         self.chatflow = None
+        self._commands = None
 
     @property
     def message_text(self):
@@ -53,9 +63,9 @@ class PlayerBotRequest(BotRequest):
         return self.message.chat_id
 
     def get_commands(self):
-        return {c: [n for n, f in cmds]
-                for c, cmds
-                in self.chatflow.get_commands_by_category().items()}
+        if self._commands is None:
+            self._commands = self.chatflow.get_commands_by_category()
+        return self._commands
 
     def process_message(self, chatflow):
         self.chatflow = chatflow
@@ -66,6 +76,32 @@ class PlayerBotRequest(BotRequest):
             return True
         return False
 
+    def get_keyboard(self, category, commands):
+        """
+        Returns a short hash of the keyboard and its markup, built once per category and set of commands.
+        """
+        key = (category, tuple((c, tuple(names)) for c, names in commands.items()))
+        cached = self.keyboards.get(key)
+        if cached is None:
+            from telegram import ReplyKeyboardMarkup
+
+            keyboard = []
+            # for category in commands:
+            for i in range(0, len(commands[category]), 4):
+                row = commands[category][i:i + 4]
+                row = [f"{self.cmd_pfx}{c}" for c in row]
+                keyboard.append(row)
+
+            icons = {c: i for c, i in self.category_icons}
+            icon_row = [icons[c] for c in commands if c in icons]
+            if len(icon_row) > 1:
+                keyboard.append(icon_row)
+
+            keyboard_hash = md5(repr(keyboard).encode()).hexdigest()[:8]
+            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            cached = self.keyboards[key] = (keyboard_hash, reply_markup)
+        return cached
+
     def get_send_message_args(self):
         commands = self.get_commands()
         category = self.session.get("category")
@@ -73,27 +109,13 @@ class PlayerBotRequest(BotRequest):
             category = next(iter(commands.keys()))
             self.session.set('category', category)
 
-        keyboard = []
-        # for category in commands:
-        for i in range(0, len(commands[category]), 4):
-            row = commands[category][i:i + 4]
-            row = [f"{self.cmd_pfx}{c}" for c in row]
-            keyboard.append(row)
-
-        icons = {c: i for c, i in self.category_icons}
-        icon_row = [icons[c] for c in commands if c in icons]
-        if len(icon_row) > 1:
-            keyboard.append(icon_row)
-
-        keyboard_repr = repr(keyboard)
-        if keyboard_repr == self.session.get('keyboard', 'None'):
+        keyboard_hash, reply_markup = self.get_keyboard(category, commands)
+        if keyboard_hash == self.session.get('keyboard'):
             push = False
         else:
-            self.session.set('keyboard', keyboard_repr)
+            self.session.set('keyboard', keyboard_hash)
             push = True
 
-        reply_markup = telegram.ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
         flag_seen_player = False
         for args in super().get_send_message_args():
             if args["chat_id"] == self.message.chat_id:
@@ -106,12 +128,28 @@ class PlayerBotRequest(BotRequest):
 
 
 class Bot():
+    """
+    Telegram client and session storage are created on first use, so that importing the module costs nothing.
+    """
     cmd_pfx = CommandPrefix('/')
 
     def __init__(self, *args, **kwargs):
-        self.bot = telegram.Bot(settings.TOKEN, *args, **kwargs)
-        session_storage = PlayerSessionsStorage()
-        self.get_session = session_storage.get_session
+        self.args = args
+        self.kwargs = kwargs
+        self._bot = None
+        self._session_storage = None
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            import telegram
+            self._bot = telegram.Bot(settings.TOKEN, *self.args, **self.kwargs)
+        return self._bot
+
+    def get_session(self, chatkey):
+        if self._session_storage is None:
+            self._session_storage = PlayerSessionsStorage(ttl=settings.SESSION_TTL)
+        return self._session_storage.get_session(chatkey)
 
     def set_webhook(self, *args, **kwargs):
         self.bot.setWebhook(*args, **kwargs)
@@ -121,9 +159,21 @@ class Bot():
         return BotRequest(self.bot)
 
     def get_player_bot_request(self, request):
-        update = telegram.update.Update.de_json(request.get_json(force=True), self)
+        from telegram.update import Update
+
+        update = Update.de_json(request.get_json(force=True), self)
         if update.message is not None:
             return PlayerBotRequest(self.bot, update.message, self.get_session(update.message.chat_id), self.cmd_pfx)
 
 
 bot = Bot()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if argv[1:] == ['set_webhook']:
+        with open(settings.CERT, 'rb') as certificate:
+            bot.set_webhook(url=f"https://{settings.WEBHOOK_HOST}/{settings.TOKEN}", certificate=certificate)
+    else:
+        print(f"Usage: {argv[0]} set_webhook")
@@ -11,5 +11,5 @@ fi
 
 project=$(basename $(pwd))
 remote-sync --no-rsync
-ssh bakunin.nl "cd /home/pha/$project && ./setup.sh && sudo service uwsgi restart"
+ssh bakunin.nl "cd /home/pha/$project && ./setup.sh && /home/pha/virtualenv/$project/bin/python bot.py set_webhook && sudo service uwsgi restart"
 
@@ -6,13 +6,11 @@ from mud.player import Chatflow
 from mud.locations import Field, TownGate, VillageHouse, MarketSquare, Factory
 from mud.production import Land, Distaff, Workbench
 from mud.npcs import PeasantState, GuardState, MerchantState
-from mud.commodities import DirtyRags, RoughspunTunic, Overcoat
+from mud.commodities import Commodity, DirtyRags, RoughspunTunic, Overcoat
 
 from bot import bot
 from storage import Storage
 
-from deepdiff import DeepDiff
-
 
 migrations = list()
 
@@ -157,8 +155,29 @@ def migrate_9(storage):
                     del actor.counters[key]
 
 
+@version
+def migrate_10(storage):
+    # fungible commodities are stored inline as stacks now, drop their entities
+    list(storage.all_players())  # load every bag before forgetting the entities
+    for cls in Commodity.__subclasses__():
+        if cls.fungible:
+            classname = cls.__name__
+            for entity in storage.entities[classname].values():
+                del storage.entitykeys[entity]
+            storage.entities[classname].clear()
+            storage.discarded_keys.update(storage.redis.keys(storage._entity_key % (classname, '*')))
+
+
+@version
+def migrate_11(storage):
+    # players who sleep are hibernated out of locations
+    for player in storage.all_players():
+        if player.alive and 'active' not in player.cooldown:
+            player.get_mutator(storage.world).hibernate()
+
+
 # @version
-# def migrate_10(storage):
+# def migrate_12(storage):
 #     for actor in storage.world.actors():
 #         if actor.max_hitpoints and actor.alive:
 #             actor.hitpoints = actor.max_hitpoints
@@ -191,6 +210,7 @@ def migrate(dry_run=True):
         storage.print_dump()
         print()
         print("Difference:")
+        from deepdiff import DeepDiff
         pprint(DeepDiff(current_dump, dict(storage.dump()), verbose_level=2))
         storage.lock_object.release()
     else:
@@ -1,53 +1,106 @@
 from .attacks import Bash
 from .states import State
-from .utils import condition, Verb
+from .utils import condition, all_subclasses, CaptionIndex, Verb
 
 
 class Commodity(State):
-    def plural(self, n):
-        return self._add_icon(self.abstract_plural % n)
+    __slots__ = ('count',)
+    fungible = True  # units are interchangeable and are kept in stacks
+    abstract_plural = None
+    _classes_index = None
+
+    def __init__(self):
+        self.count = 1
+
+    @classmethod
+    def stack(cls, count=1):
+        stack = cls()
+        stack.count = count
+        return stack
 
-    def __getattribute__(self, attr):
-        if attr == "plural" and not hasattr(self, 'abstract_plural'):
-            raise AttributeError
-        return super(Commodity, self).__getattribute__(attr)
+    @property
+    def plural(self):
+        # commodities without abstract_plural (e.g. "an overcoat") are never counted
+        return self._plural if self.abstract_plural else None
+
+    def _plural(self, n):
+        return self._add_icon(self.abstract_plural % n)
 
     @property
     def descr(self):
         return self.name
 
+    @classmethod
+    def find_classes(cls, name):
+        """
+        Finds commodity classes by a class name or by words of their names.
+
+        >>> [c.__name__ for c in Commodity.find_classes('sets of')]
+        ['DirtyRags', 'Overalls']
+        """
+        if Commodity._classes_index is None:
+            classes = [c for c in all_subclasses(Commodity) if getattr(c, 'abstract_name', None)]
+            index = CaptionIndex(f"{c.abstract_name} {c.abstract_plural or ''}" for c in classes)
+            Commodity._classes_index = ({c.__name__: c for c in classes}, classes, index)
+        by_name, classes, index = Commodity._classes_index
+        if name in by_name:
+            return [by_name[name]]
+        return [classes[i] for i in index.find(name)]
+
+    @classmethod
+    def find_class(cls, name):
+        """
+        Finds a commodity class by its class name or by words of its names, None if not found or ambiguous.
+
+        >>> Commodity.find_class('Cotton').__name__, Commodity.find_class('vegetables').__name__
+        ('Cotton', 'Vegetable')
+
+        >>> Commodity.find_class('sets') is None
+        True
+        """
+        found = cls.find_classes(name)
+        return found[0] if len(found) == 1 else None
+
 
 class ActionClasses(object):
-    pass
+    __slots__ = ()
 
 
 class Edibles(ActionClasses):
+    __slots__ = ()
     verb = Verb('eat', third='eats')
 
 
 class Vegetable(Commodity, Edibles):
+    __slots__ = ()
     icon = '🥕'
     abstract_name = 'a vegetable'
     abstract_plural = '%d vegetables'
 
 
 class Mushroom(Commodity, Edibles):
+    __slots__ = ()
     icon = '🍄'
     abstract_name = 'a mushroom'
     abstract_plural = '%d mushrooms'
 
 
 class Cotton(Commodity):
+    __slots__ = ()
     icon = '☁️'
     abstract_name = 'cotton'
     abstract_plural = '%d balls of cotton'
 
 
 class Wieldables(ActionClasses):
+    __slots__ = ()
     verb = Verb('wield', third='wields')
 
 
 class Deteriorates(object):
+    __slots__ = ()  # subclasses keep usages in their own slot
+    fungible = False
+    transient_attrs = {'count'}  # never stacked, so there's always one unit
     conditions = [
         'slightly used',
         'used',
@@ -57,6 +110,7 @@ class Deteriorates(object):
     ]
 
     def __init__(self):
+        super().__init__()
         self.usages = 0
 
     @property
@@ -72,7 +126,7 @@ class Deteriorates(object):
     def name_with_condition(self):
         return self._add_icon(self.abstract_name % self.condition)
 
-    def plural(self, n):
+    def _plural(self, n):
         return self._add_icon(self.abstract_plural % (n, self.condition))
 
     @property
@@ -113,6 +167,7 @@ class Deteriorates(object):
 
 
 class Spindle(Deteriorates, Commodity, Wieldables):
+    __slots__ = ('usages',)
     icon = '🌀'
     max_usages = 3
     abstract_name = 'a%s spindle'
@@ -121,10 +176,11 @@ class Spindle(Deteriorates, Commodity, Wieldables):
 
 
 class Weapon(object):
-    pass
+    __slots__ = ()
 
 
 class Shovel(Deteriorates, Commodity, Wieldables, Weapon):
+    __slots__ = ('usages',)
     max_usages = 5
     abstract_name = 'a%s shovel'
     abstract_plural = '%d%s shovels'
@@ -133,16 +189,19 @@ class Shovel(Deteriorates, Commodity, Wieldables, Weapon):
 
 
 class Wearables(ActionClasses):
+    __slots__ = ()
     verb = Verb('wear', third='wears')
 
 
 class DirtyRags(Commodity, Wearables):
+    __slots__ = ()
     icon = '🧦'
     abstract_name = 'dirty rags'
     abstract_plural = '%d sets of dirty rags'
 
 
 class RoughspunTunic(Deteriorates, Commodity, Wearables):
+    __slots__ = ('usages',)
     icon = '👚'
     abstract_name = 'a%s roughspun tunic'
     abstract_plural = '%d%s roughspun tunics'
@@ -152,16 +211,19 @@ class RoughspunTunic(Deteriorates, Commodity, Wearables):
 
 
 class Overcoat(Commodity, Wearables):
+    __slots__ = ()
     icon = '🧥'
     abstract_name = 'an overcoat'
 
 
 class Overalls(Commodity, Wearables):
+    __slots__ = ()
     icon = '👖'
     abstract_name = 'overalls'
     abstract_plural = '%d sets of overalls'
 
 
 class FlamboyantAttire(Commodity, Wearables):
+    __slots__ = ()
     icon = '🎩'
     abstract_name = 'flamboyant attire'
@@ -1,5 +1,7 @@
-from random import choice
-from collections import defaultdict
+from random import choice, Random
+from collections import defaultdict, deque
+
+from .utils import list_sentence
 
 
 class Direction(str):
@@ -26,12 +28,16 @@ Direction.all = Direction.compass + (enter, exit)
 
 
 class Location(object):
+    chunk = None  # hand-built locations are always loaded, generated ones are loaded chunk by chunk
+    index = None  # position in the world map, generated locations aren't on it
+
     def __init__(self, id, name, descr):
         self.id = id
         self.name = name
         self.descr = descr
         if not hasattr(type(self), 'exits'):
             self.exits = {}
+        self._exits_descr = {}  # command prefix -> sentences about exits
         self.register()
 
     def register(self):
@@ -46,12 +52,30 @@ class Location(object):
                 break
             cls, = cls.__bases__
 
+    @staticmethod
+    def get(id):
+        """
+        Returns a location by id, generating the chunk of a region it belongs to on first access.
+        """
+        location = Location.all.get(id)
+        if location is None:
+            region = Region.find(id)
+            if region is None:
+                raise KeyError(id)
+            region.generate_chunk(region.get_chunk(id))
+            location = Location.all[id]
+        return location
+
     def to(self, destination, direction, descr_to, descr_back):
         self.add_exit(direction, descr_to, destination)
         destination.add_exit(direction.opposite, descr_back, self)
 
     def add_exit(self, direction, descr, location):
-        self.exits[direction] = dict(descr=descr, location=location)
+        self.set_exit(direction, dict(descr=descr, location=location))
+
+    def set_exit(self, direction, exit):
+        self.exits[direction] = exit
+        self._exits_descr.clear()
 
     def get_exit_groups(self):
         exits = self.exits
@@ -71,6 +95,16 @@ class Location(object):
         for descr, ds in bydescr.items():
             yield descr, ds
 
+    def get_exits_descr(self, cmd_pfx):
+        """
+        Returns sentences about exits, composed once per command prefix.
+        """
+        sentences = self._exits_descr.get(cmd_pfx)
+        if sentences is None:
+            sentences = self._exits_descr[cmd_pfx] = tuple(
+                descr % list_sentence(cmd_pfx + d for d in directions) for descr, directions in self.get_exit_groups())
+        return sentences
+
 
 StartLocation = Field = Location('loc_field', '🌾 a field', 'in a middle of 🌾 a field.')
 
@@ -86,15 +120,23 @@ class ForestLocation(Location):
 class MagicExit(object):
     def __init__(self, exclude):
         self.exclude = exclude
+        self.forests = self.woods = ()
+
+    def compile(self):
+        """
+        Takes candidate lists once the map is complete, so that going through the exit doesn't build them.
+        """
+        self.forests = tuple(ForestLocation.all.values())
+        self.woods = tuple(l for l in WoodsLocation.all.values() if self.exclude not in l.id)
 
     def __getitem__(self, key):
         if key == "descr":
             return "You can go %s"
 
         if key == "location":
-            loc = choice(list(ForestLocation.all.values()))
+            loc = choice(self.forests)
             if isinstance(loc, WoodsLocation) and self.exclude in loc.id:
-                return choice(list(l for l in WoodsLocation.all.values() if self.exclude not in l.id))
+                return choice(self.woods)
             return loc
 
         raise KeyError
@@ -149,3 +191,187 @@ FactoryDistrict.to(Factory, enter, 'You can %s 🏭 a factory building.', 'You c
 Slums = Location('loc_slum', 'slums', 'in a slum area.')
 
 FactoryDistrict.to(Slums, south, 'To the %s you see slums.', 'To the %s you see a factory.')
+
+
+class RegionExit(object):
+    """
+    An exit to a generated location, which is looked up by id only when the exit is taken.
+    """
+    __slots__ = ('descr', 'location_id')
+
+    def __init__(self, descr, location_id):
+        self.descr = descr
+        self.location_id = location_id
+
+    def __getitem__(self, key):
+        if key == "descr":
+            return self.descr
+
+        if key == "location":
+            return Location.get(self.location_id)
+
+        raise KeyError
+
+
+class GeneratedLocation(Location):
+    def __init__(self, id, name, descr, chunk):
+        self.chunk = chunk
+        super().__init__(id, name, descr)
+
+
+class Region(object):
+    """
+    A width by height grid of locations generated from a seed, a square chunk at a time, on first access.
+
+    Any location can be generated again from the seed alone, so only states of visited locations get stored.
+    Columns are always passable north to south and the southmost row west to east, so the grid is connected.
+    """
+    all = {}  # prefix -> region
+
+    def __init__(self, prefix, seed, width, height, terrains, chunk_size=8, passability=.3):
+        if prefix in Region.all:
+            raise Exception('Region %s exists' % prefix)
+        Region.all[prefix] = self
+        self.prefix = prefix
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.terrains = terrains  # (name, descr) pairs
+        self.chunk_size = chunk_size
+        self.passability = passability
+        self.gates = {}  # (x, y) -> [(direction, descr, location)]
+
+    @staticmethod
+    def find(id):
+        for prefix, region in Region.all.items():
+            if id.startswith(f"loc_{prefix}_"):
+                return region
+
+    def get_id(self, x, y):
+        return f"loc_{self.prefix}_{x}_{y}"
+
+    def get_coords(self, id):
+        try:
+            x, y = map(int, id[len(self.prefix) + 5:].split('_'))
+        except ValueError:
+            raise KeyError(id)
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise KeyError(id)
+        return x, y
+
+    def get_chunk(self, id):
+        x, y = self.get_coords(id)
+        return (self.prefix, x // self.chunk_size, y // self.chunk_size)
+
+    def get_chunk_location_ids(self, chunk):
+        prefix, cx, cy = chunk
+        return [self.get_id(x, y)
+                for x in range(cx * self.chunk_size, min((cx + 1) * self.chunk_size, self.width))
+                for y in range(cy * self.chunk_size, min((cy + 1) * self.chunk_size, self.height))]
+
+    def get_neighbour_chunks(self, chunk):
+        """
+        Returns the chunk itself and the chunks around it.
+        """
+        prefix, cx, cy = chunk
+        return [(prefix, x, y)
+                for x in range(max(cx - 1, 0), min(cx + 2, (self.width - 1) // self.chunk_size + 1))
+                for y in range(max(cy - 1, 0), min(cy + 2, (self.height - 1) // self.chunk_size + 1))]
+
+    def get_cell(self, x, y):
+        """
+        Returns terrain of a location and whether it's passable to the east, the same for the same seed.
+        """
+        random = Random(f"{self.seed}:{x}:{y}")
+        terrain = random.choice(self.terrains)
+        east = x + 1 < self.width and (y == 0 or random.random() < self.passability)
+        return terrain, east
+
+    def get_neighbours(self, x, y):
+        if y + 1 < self.height:
+            yield north, x, y + 1
+        if y > 0:
+            yield south, x, y - 1
+        if self.get_cell(x, y)[1]:
+            yield east, x + 1, y
+        if x > 0 and self.get_cell(x - 1, y)[1]:
+            yield west, x - 1, y
+
+    def connect(self, location, direction, descr_to, descr_back, x=0, y=0):
+        location.set_exit(direction, RegionExit(descr_to, self.get_id(x, y)))
+        self.gates.setdefault((x, y), []).append((direction.opposite, descr_back, location))
+
+    def generate_chunk(self, chunk):
+        for id in self.get_chunk_location_ids(chunk):
+            x, y = self.get_coords(id)
+            (name, descr), _ = self.get_cell(x, y)
+            location = GeneratedLocation(id, name, descr, chunk)
+            for direction, nx, ny in self.get_neighbours(x, y):
+                (name, _), _ = self.get_cell(nx, ny)
+                location.set_exit(direction, RegionExit(f"To the %s you see {name}.", self.get_id(nx, ny)))
+            for direction, descr, destination in self.gates.get((x, y), ()):
+                location.add_exit(direction, descr, destination)
+
+
+Wasteland = Region('wasteland', seed='wasteland', width=64, height=64, terrains=(
+    ('a wasteland', 'in a wasteland.'),
+    ('a dry riverbed', 'in a dry riverbed.'),
+    ('a heap of slag', 'on a heap of slag.'),
+    ('a scrapyard', 'in a scrapyard.'),
+    ('ruins', 'among ruins.')))
+
+Wasteland.connect(Slums, south, 'To the %s you see a wasteland.', 'To the %s you see slums.',
+                  x=0, y=Wasteland.height - 1)
+
+
+class WorldMap(object):
+    """
+    Locations compiled into integer-indexed arrays: adjacency of ordinary exits and a next-hop routing table.
+
+    Routes never go through magic exits, which lead to a random location, nor into generated regions. The routing
+    table is filled one destination at a time, with a breadth first search along the exits backwards.
+    """
+
+    def __init__(self, locations):
+        self.locations = list(locations)
+        for index, location in enumerate(self.locations):
+            location.index = index
+
+        self.adjacency = [[] for _ in self.locations]  # index -> [(direction, index of destination)]
+        self.incoming = [[] for _ in self.locations]  # index -> [(direction, index of source)]
+        for location in self.locations:
+            for direction, x in location.exits.items():
+                if isinstance(x, MagicExit):
+                    x.compile()
+                if not isinstance(x, dict):
+                    continue
+                self.adjacency[location.index].append((direction, x['location'].index))
+                self.incoming[x['location'].index].append((direction, location.index))
+
+        self.next_hops = [None] * len(self.locations)  # index of destination -> direction by index of source
+
+    def get_next_hops(self, destination):
+        hops = self.next_hops[destination]
+        if hops is None:
+            hops = self.next_hops[destination] = [None] * len(self.locations)
+            visited = {destination}
+            queue = deque([destination])
+            while queue:
+                index = queue.popleft()
+                for direction, source in self.incoming[index]:
+                    if source not in visited:
+                        visited.add(source)
+                        hops[source] = direction
+                        queue.append(source)
+        return hops
+
+    def route(self, source, destination):
+        """
+        Returns the direction of the first step of a shortest way from source to destination, None if there's none.
+        """
+        if source.index is None or destination.index is None:
+            return None
+        return self.get_next_hops(destination.index)[source.index]
+
+
+world_map = WorldMap(Location.all.values())
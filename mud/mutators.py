@@ -1,8 +1,6 @@
-from itertools import chain
-
 from .commodities import Commodity, Edibles, Wearables, Wieldables, Deteriorates, Mushroom
 from .production import MeansOfProduction
-from .utils import credits, pretty_list, FilterSet
+from .utils import credits, pretty_list, render, unit, Announcement, LazyMessage, StackedFilterSet
 
 
 class lazy_action(object):
@@ -20,16 +18,40 @@ class lazy_action(object):
 
 class ActorMutator:
     default_wear = None
+    cooldown_announces = {}  # counter -> announces, merged along the MRO
+    is_gatekeeper = False  # has allow(visitor, to) to be asked before anyone leaves the location
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.cooldown_announces = {}
+        for c in reversed(cls.__mro__):
+            cls.cooldown_announces.update(vars(c).get('cooldown_announce', {}))
+        cls.is_gatekeeper = callable(getattr(cls, 'allow', None))
 
     def __init__(self, actor, world):
         self.actor = actor
         self.world = world
 
+    def bind(self, actor, world):
+        # mutators and their lazy actions are cached per actor, rebind them all at once
+        self.actor = actor
+        self.world = world
+        for value in vars(self).values():
+            if isinstance(value, Action):
+                value.bind(actor, world)
+
+    @classmethod
+    def _add_action(cls, verb, action_cls, *args):
+        if '_actions' not in vars(cls):
+            cls._actions = {}
+        cls._actions[verb] = action_cls
+        setattr(cls, verb, lazy_action(action_cls, *args))
+
     @classmethod
     def action(cls, action_name):
         def decorator(action_cls):
             action_cls.verb = action_name
-            setattr(cls, action_name, lazy_action(action_cls))
+            cls._add_action(action_name, action_cls)
             return action_cls
         return decorator
 
@@ -37,11 +59,20 @@ class ActorMutator:
     def actions(cls, args):
         def decorator(action_cls):
             for arg in args:
-                verb = getattr(arg, 'verb', arg)
-                setattr(cls, verb, lazy_action(action_cls, arg))
+                cls._add_action(getattr(arg, 'verb', arg), action_cls, arg)
             return action_cls
         return decorator
 
+    @classmethod
+    def get_action_classes(cls):
+        """
+        Returns action classes by verb, of actions added to the class and its bases.
+        """
+        actions = {}
+        for c in reversed(cls.__mro__):
+            actions.update(vars(c).get('_actions', {}))
+        return actions
+
     @property
     def location(self):
         return self.world[self.actor.location.id]
@@ -53,48 +84,50 @@ class ActorMutator:
     def say_to(self, actor, message):
         actor.send(f"*{self.actor.Name}*: {message}")
 
-    def announce(self, message, reflect=None, objective=None, possessive=False):
+    def announce(self, message, reflect=None, objective=None, possessive=False, move=None):
         # TODO: looks like it's possible to move reflect to PlayerMutator
+        # messages can be callables, they're called only for actors who get them
+        # move is (source, destination) of the actor, it lets announces of movements be merged
+        stats = self.world.message_stats
         skip_senders = {self.actor}
         if not possessive:
-            you, them = "You", self.actor.Name
+            you, them = "You", lambda: self.actor.Name
         else:
-            you, them = "Your", f"{self.actor.Name}'s"
+            you, them = "Your", lambda: f"{self.actor.Name}'s"
         # reflect message is sent to the sender itself (e.g. "You attack rat")
-        if reflect and self.actor.recieves_announces:
-            if reflect is True:
-                reflect = message
-            self.actor.send(f"{you} {reflect}")
+        if reflect:
+            if self.actor.recieves_announces:
+                if reflect is True:
+                    reflect = message
+                self.actor.send(f"{you} {render(reflect)}")
+                stats['formatted'] += 1
+            else:
+                stats['suppressed'] += 1
         # objective message (if present) is sent to the target of announced action (e.g. "Rat attacks you")
         if objective:
             objective, target_actor = objective
             if target_actor.recieves_announces:
-                target_actor.send(f"{them} {objective}")
+                target_actor.send(f"{them()} {render(objective)}")
+                stats['formatted'] += 1
+            else:
+                stats['suppressed'] += 1
             skip_senders.add(target_actor)
         # the message itself is broadcast
-        self.location.broadcast(f"{them} {message}", skip_senders=skip_senders)
-
-    def get_default_cooldown_announces(self):
-        queue = {type(self)}
-        while queue:
-            cls = queue.pop()
-            queue.update(cls.__bases__)
-            if hasattr(cls, 'cooldown_announce'):
-                yield cls.cooldown_announce
+        broadcast = LazyMessage(lambda: Announcement(f"{them()} {render(message)}", move and (self.actor,) + move))
+        self.location.broadcast(broadcast, skip_senders=skip_senders)
+        stats['formatted' if broadcast.is_formatted else 'suppressed'] += 1
 
     def announce_cooldown(self, counter, is_set, is_new=False, announce=None):
         if announce is None:
-            for cooldown_announce in self.get_default_cooldown_announces():
-                if counter in cooldown_announce:
-                    announces = cooldown_announce[counter]
-                    key = 'first' if is_set and is_new and 'first' in announces else is_set
-                    announce = announces.get(key)
-                    break
+            announces = self.cooldown_announces.get(counter)
+            if announces:
+                key = 'first' if is_set and is_new and 'first' in announces else is_set
+                announce = announces.get(key)
         if announce:
             if isinstance(announce, tuple):
                 self.announce(*announce)
             else:
-                self.announce(f"is {announce}.", f"are {announce}.")
+                self.announce(lambda: f"is {announce}.", lambda: f"are {announce}.")
 
     def _set(self, counters, counter, value, announce=None):
         if value > 0:
@@ -128,13 +161,26 @@ class ActorMutator:
     def act(self):
         self.dec_cooldowns()
 
+    def update_listening(self):
+        if self.actor.location is not None:
+            self.location.update_listener(self.actor)
+
+    def update_view(self):
+        """
+        Tells the location that the actor looks differently, e.g. attacks someone or does something else.
+        """
+        if self.actor.location is not None:
+            self.location.bump_version()
+
     def _relocate_self(self, destination):
         source = self.actor.location
-        self.announce('leaves to %s.' % destination.name)
+        self.announce(lambda: 'leaves to %s.' % destination.name, move=(None, destination))
         self.location.actors.remove(self.actor)
+        self.update_listening()
         self.actor.location = destination
-        self.announce('arrives from %s.' % source.name)
+        self.announce(lambda: 'arrives from %s.' % source.name, move=(source, None))
         self.location.actors.add(self.actor)
+        self.update_listening()
         self.deteriorate(self.actor.wears)
 
     def spawn(self, location):
@@ -145,6 +191,7 @@ class ActorMutator:
             self.victim = None
             self.actor.location = location
             self.location.actors.add(self.actor)
+            self.update_listening()
             self.announce('materializes.')
             if self.actor.max_hitpoints:
                 self.actor.hitpoints = self.actor.max_hitpoints
@@ -156,6 +203,7 @@ class ActorMutator:
             self._relocate_to_slot('wears', None)
             self.drop(self.actor.bag)
             self.location.actors.remove(self.actor)
+            self.update_listening()
             self.actor.location = None
             self.actor.alive = False
 
@@ -165,32 +213,31 @@ class ActorMutator:
             items.update(item_or_items)
         except TypeError:
             items.add(item_or_items)
-        items = items & source
-        if items and not dry:
-            if destination is not None:
-                destination.update(items)
-            source.difference_update(items)
-        return FilterSet(items)
+        items = source.take(items, dry=dry)
+        if items and not dry and destination is not None:
+            destination.update(items)
+        return items
 
     def _relocate_to_slot(self, slot, item):
         current = getattr(self.actor, slot)
         if current is item:
             return False
         if item:  # can be None
-            items = self._relocate(item, self.actor.bag)
+            items = self._relocate(unit(item), self.actor.bag)
             if not items:
                 return False
             item, = items
         setattr(self.actor, slot, item)
         if current is not None:
             self.actor.bag.add(current)
+        self.update_view()
         return True
 
     def barter(self, counterparty, what, for_what):
         if (counterparty.barters
                 and counterparty.get_mutator(self.world).accept_barter(self.actor, what, for_what)):
-            announce = f"{pretty_list(what)} for {pretty_list(for_what)} with {counterparty.name}"
-            self.announce(f'barters {announce}.', f'barter {announce}.')
+            announce = LazyMessage(lambda: f"{pretty_list(what)} for {pretty_list(for_what)} with {counterparty.name}")
+            self.announce(lambda: f'barters {announce}.', lambda: f'barter {announce}.')
 
     def accept_barter(self, counterparty, what, for_what):
         return (
@@ -201,8 +248,8 @@ class ActorMutator:
         if self._relocate(what, source, destination):
             self.actor.credits -= price
             counterparty.credits += price
-            announce = f"{pretty_list(what)} {prep} {counterparty.name}"
-            self.announce(f'{verb}s {announce}.', f'{verb} {announce} for {credits(abs(price))}.')
+            announce = LazyMessage(lambda: f"{pretty_list(what)} {prep} {counterparty.name}")
+            self.announce(lambda: f'{verb}s {announce}.', lambda: f'{verb} {announce} for {credits(abs(price))}.')
 
     def buy(self, counterparty, what):
         if counterparty.sells:
@@ -217,7 +264,7 @@ class ActorMutator:
                 self._make_transaction("sell", "to", counterparty, what, -price, self.actor.bag, counterparty.bag)
 
     def _get_price(self, counterparty, what):
-        return 1 if isinstance(what, Commodity) else len(what)
+        return what.count if isinstance(what, Commodity) else len(what)
 
     accept_buy = _get_price
     accept_sell = _get_price
@@ -227,6 +274,7 @@ class ActorMutator:
             return False
 
         commodity.usages += 1
+        self.update_view()  # worn and wielded things show their condition
         if commodity.usages < commodity.max_usages:
             return False
 
@@ -254,7 +302,8 @@ class ActorMutator:
                 and victim.location is self.actor.location
                 and victim.get_mutator(self.world).accept_attack(self.actor)):
             self.actor.victim = victim
-            self.announce(f'attacks {victim.name}.', announce)
+            self.update_view()
+            self.announce(lambda: f'attacks {victim.name}.', announce)
             return True
         return False
 
@@ -263,6 +312,7 @@ class ActorMutator:
             self.actor.attack_queue.append(attacker)
         else:
             self.actor.victim = attacker
+            self.update_view()
         return True
 
     def kick(self, method):
@@ -278,14 +328,14 @@ class ActorMutator:
             if not weapon or weapon.attack is not method:
                 return False
 
-            self.announce(f'{method.verb_s} {victim.name} with {self.actor.weapon.name}.',
-                          f'{method} {victim.name} with {self.actor.weapon.name}.',
-                          (f'{method.verb_s} you with {self.actor.weapon.name}.', victim))
+            self.announce(lambda: f'{method.verb_s} {victim.name} with {weapon.name}.',
+                          lambda: f'{method} {victim.name} with {weapon.name}.',
+                          (lambda: f'{method.verb_s} you with {weapon.name}.', victim))
             self.deteriorate(weapon)
         else:
-            self.announce(f'{method.verb_s} {victim.name}.',
-                          f'{method} {victim.name}.',
-                          (f'{method.verb_s} you.', victim))
+            self.announce(lambda: f'{method.verb_s} {victim.name}.',
+                          lambda: f'{method} {victim.name}.',
+                          (lambda: f'{method.verb_s} you.', victim))
 
         if victim.max_hitpoints:
             victim.hitpoints -= method.damage
@@ -305,6 +355,7 @@ class ActorMutator:
                 or not self.actor.alive  # actor's dead
                 or victim.location is not self.actor.location):  # someone ran away
             victim = self.actor.victim = queue.pop() if queue else None
+            self.update_view()
 
 
 class Action(ActorMutator):
@@ -342,6 +393,7 @@ class Action(ActorMutator):
 
     is_available = True
     is_coolingdown = False
+    failed = False  # whether the last call failed
 
     @property
     def is_possible(self):
@@ -354,17 +406,21 @@ class Action(ActorMutator):
         return False
 
     def __call__(self, *args):
+        self.failed = True
         if not self.is_available:
             return self.error_unavailable(*args)
         if self.is_coolingdown:
             return self.error_coolsdown(*args)
+        self.failed = False
         return self.after_checks(*args)
 
     def after_checks(self, *args):
         try:
             result = self.mutate(*args)
         except self.mutate_failure as failure:
+            self.failed = True
             return failure()
+        self.failed = not result
         if result:
             self.on_success(result)
         return self.on_done(result)
@@ -399,9 +455,8 @@ class GoAction(ActionWithArgs):
 
     def mutate(self, direction):
         destination = self.actor.location.exits[direction]['location']
-        for actor in self.location.actors:
-            if (hasattr(actor.mutator_class, 'allow')
-                    and not actor.get_mutator(self.world).allow(self.actor, destination)):
+        for actor in self.location.gatekeepers:
+            if not actor.get_mutator(self.world).allow(self.actor, destination):
                 return False
         self._relocate_self(destination)
         return True
@@ -426,7 +481,7 @@ class PickAction(RelocateItemsAction):
         return self.actor.bag
 
     def on_success(self, items):
-        self.announce(f"picks up {items}.")
+        self.announce(lambda: f"picks up {items}.")
 
 
 @ActorMutator.action("drop")
@@ -440,7 +495,7 @@ class DropAction(RelocateItemsAction):
         return self.location.items
 
     def on_success(self, items):
-        self.announce(f"drops {items} on the ground.")
+        self.announce(lambda: f"drops {items} on the ground.")
 
 
 class ItemAction(ActionWithArgs):
@@ -455,7 +510,7 @@ class ItemAction(ActionWithArgs):
             raise self.mutate_failure(lambda: self.error_wrong_class(item))
 
     def on_success(self, item):
-        self.announce(f'{self.verb.third} {item.name}.')
+        self.announce(lambda: f'{self.verb.third} {item.name}.')
 
 
 @ActorMutator.action(Edibles.verb)
@@ -465,7 +520,7 @@ class EatAction(ItemAction):
 
     def mutate(self, item):
         super().mutate(item)
-        result = self._relocate(item, self.actor.bag)  # _relocate returns a set
+        result = self._relocate(unit(item), self.actor.bag)  # _relocate returns a set
         return result.pop() if result else None
 
     def on_success(self, item):
@@ -497,10 +552,11 @@ class UnequipAction(Action):
         item = self.actor.wields
         self.actor.wields = None
         self.actor.bag.add(item)
+        self.update_view()
         return item
 
     def on_success(self, item):
-        self.announce(f'puts away {item.name}.')
+        self.announce(lambda: f'puts away {item.name}.')
 
 
 @ActorMutator.actions(MeansOfProduction.__subclasses__())
@@ -531,11 +587,11 @@ class ProduceAction(Action):
         return False
 
     def on_success(self, fruit_or_fruits):
-        self.announce(f"{self.verb.third} {fruit_or_fruits}.")
+        self.announce(lambda: f"{self.verb.third} {fruit_or_fruits}.")
 
     def get_tools_and_materials(self):
         means = self.means
-        missing = FilterSet()
+        missing = StackedFilterSet()
         tools = {}
         # get required/optional tools
         for t in means.optional_tools | means.required_tools:
@@ -551,11 +607,11 @@ class ProduceAction(Action):
         # get required materials
         materials = {}
         for t, n in means.required_materials.items():
-            loc = list(self.actor.bag.filter(t))
-            if len(loc) >= n:
-                materials[t] = loc[:n]
+            available = self.actor.bag.count(t)
+            if available >= n:
+                materials[t] = t.stack(n)
             else:
-                missing.update(t() for _ in range(n - len(loc)))
+                missing.add(t.stack(n - available))
         # do we miss something?
         return missing, tools, materials
 
@@ -564,7 +620,7 @@ class ProduceAction(Action):
         if missing:
             raise self.mutate_failure(lambda: self.error_missing(missing))
 
-        self._relocate(chain.from_iterable(materials.values()), self.actor.bag)
+        self._relocate(materials.values(), self.actor.bag)
 
         if tools:
             tool, = tools.values()
@@ -580,7 +636,7 @@ class ProduceAction(Action):
         if fruit_or_fruits is None:
             return
 
-        result = FilterSet()
+        result = StackedFilterSet()
         try:
             result.update(fruit_or_fruits)
         except TypeError:
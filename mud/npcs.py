@@ -1,7 +1,7 @@
 from .states import ActorState
 from .mutators import ActorMutator
 from .commodities import Edibles, DirtyRags, Overcoat, FlamboyantAttire, RoughspunTunic, Spindle
-from .locations import Field, Village, VillageHouse, TownGate, MarketSquare
+from .locations import Field, VillageHouse, TownGate, MarketSquare, world_map
 from .attacks import HumanAttacks, OrganicAttacks, Bite
 
 
@@ -25,14 +25,26 @@ class NpcMutator(ActorMutator):
         if self.actor.doing_descr != doing_descr:
             self.announce("is %s." % doing_descr)
             self.actor.doing_descr = doing_descr
+            self.update_view()
 
         elif self.dec_counter(doing):
             if self.actor.doing_descr == doing_descr:
                 self.actor.doing_descr = None
+                self.update_view()
             return True
 
         raise self.IsNotDoneYet
 
+    def walk(self, destination, doing_descr):
+        """
+        Goes one exit towards destination per walking counter, along the routes of the compiled map.
+        """
+        while self.actor.location is not destination and self.is_done("walking", doing_descr, 5):
+            direction = world_map.route(self.actor.location, destination)
+            if direction is None:
+                break
+            self.go(direction)
+
     def act(self):
         super(NpcMutator, self).act()
 
@@ -52,7 +64,7 @@ class NpcMutator(ActorMutator):
 
 
 class NpcState(ActorState):
-    mutator_class = None
+    __slots__ = ('counters', 'doing_descr', 'accumulate')
 
     def __init__(self, name=None):
         super().__init__(name)
@@ -64,14 +76,9 @@ class NpcState(ActorState):
         super_doing_descr = super().get_doing_descr(perspective)
         return super_doing_descr if super_doing_descr else self.doing_descr
 
-    def get_mutator(self, world):
-        if self.mutator_class is None:
-            return None
-        return self.mutator_class(self, world)
-
 
 class HumanNpcState(NpcState):
-    pass
+    __slots__ = ()
 
 
 class PeasantMutator(NpcMutator, HumanAttacks):
@@ -88,13 +95,7 @@ class PeasantMutator(NpcMutator, HumanAttacks):
                 self.set_cooldown("hungry", 100)
 
         if not self.coolsdown('tired'):
-            if (self.actor.location is Field
-                    and self.is_done("walking", "tired and going home", 5)):
-                self.go('north')
-
-            if (self.actor.location is Village
-                    and self.is_done("walking", "tired and going home", 5)):
-                self.go('enter')
+            self.walk(VillageHouse, "tired and going home")
 
             if (self.actor.location is VillageHouse
                     and self.is_done("resting", "resting", 20)):
@@ -105,7 +106,7 @@ class PeasantMutator(NpcMutator, HumanAttacks):
                 and self.is_done("crafting", "making a spindle", 10)):
             spindle = Spindle()
             self.actor.bag.add(spindle)
-            self.announce("makes %s." % spindle.name)
+            self.announce(lambda: "makes %s." % spindle.name)
 
         if isinstance(self.actor.wears, DirtyRags) and not self.is_("walking"):
             tunic = next(self.actor.bag.filter(RoughspunTunic), None)
@@ -117,20 +118,14 @@ class PeasantMutator(NpcMutator, HumanAttacks):
                     self.spin()
                     self.unequip()
 
-        count_edibles = len(list(self.actor.bag.filter(Edibles)))
+        count_edibles = self.actor.bag.count(Edibles)
         if not self.actor.accumulate and count_edibles <= 1:
             self.actor.accumulate = True
         elif self.actor.accumulate and count_edibles >= 5:
             self.actor.accumulate = False
 
         if self.actor.accumulate:
-            if (self.actor.location is VillageHouse
-                    and self.is_done("walking", "going to a field", 5)):
-                self.go('exit')
-
-            if (self.actor.location is Village
-                    and self.is_done("walking", "going to a field", 5)):
-                self.go('south')
+            self.walk(Field, "going to a field")
 
             if (self.actor.location is Field
                     and self.is_done("farming", "farming", 20)):
@@ -138,6 +133,7 @@ class PeasantMutator(NpcMutator, HumanAttacks):
 
 
 class PeasantState(HumanNpcState):
+    __slots__ = ()
     mutator_class = PeasantMutator
     abstract_name = "a peasant"
     definite_name = "the peasant"  # "Jack the peasant"
@@ -173,6 +169,7 @@ class GuardMutator(NpcMutator, HumanAttacks):
 
 
 class GuardState(HumanNpcState):
+    __slots__ = ()
     mutator_class = GuardMutator
     abstract_name = 'a guard'
     icon = '👮'
@@ -183,6 +180,7 @@ class MerchantMutator(NpcMutator, HumanAttacks):
 
 
 class MerchantState(HumanNpcState):
+    __slots__ = ()
     mutator_class = MerchantMutator
     abstract_name = 'a merchant'
     icon = '🤵'
@@ -201,13 +199,11 @@ class RatMutator(NpcMutator, OrganicAttacks):
     organic_attacks = {Bite}
 
     def ai(self):
-        if (self.actor.location is not Field):
-            direction = next(d for d, e in self.actor.location.exits.items() if e["location"] is Field)
-            if self.is_done("walking", "going to a field", 5):
-                self.go(direction)
+        self.walk(Field, "going to a field")
 
 
 class RatState(NpcState):
+    __slots__ = ()
     mutator_class = RatMutator
     abstract_name = 'a rat'
     icon = '🐀'
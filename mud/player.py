@@ -1,12 +1,15 @@
 import collections
+import re
 from itertools import chain
+from operator import attrgetter, methodcaller
 
 from . import mutators
 from .locations import StartLocation, Direction
-from .commodities import ActionClasses, Edibles, Wearables, Wieldables, DirtyRags, Weapon
+from .commodities import Commodity, ActionClasses, Edibles, Wearables, Wieldables, DirtyRags, Weapon
 from .states import ActorState
 from .npcs import HumanNpcState
-from .utils import credits, list_sentence, pretty_list, group_by_class, FilterSet
+from .utils import (
+    credits, list_sentence, pretty_list, group_by_class, get_name, unit, FilterSet, StackedFilterSet, CaptionIndex)
 from .production import MeansOfProduction
 from .attacks import HumanAttacks
 
@@ -29,6 +32,10 @@ class InputHandler(object):
         self.prompt = prompt
         self.cmd_pfx = cmd_pfx
         self.aborted = False
+        self.failed = False  # whether the last call was aborted, like the failure of an action
+
+    def get_prompt(self):
+        return self.prompt
 
     def _modify_arg(self, arg):
         if self.cmd_pfx and self.cmd_pfx.is_cmd(arg):
@@ -42,71 +49,142 @@ class InputHandler(object):
         abort_message = self._should_abort()
         if abort_message:
             self.state.clear()
-            self.aborted = True
+            self.aborted = self.failed = True
             return abort_message
 
         arg = self._modify_arg(arg)
         if arg is None:
             self.state.clear()
             self.state.update(command=self.command)
-            return self.prompt
+            return self.get_prompt()
         else:
             return self.f(arg)
 
 
 class ChoiceHandler(InputHandler):
+    """
+    Prompt and the numbered list of choices are built only when the prompt is actually shown.
+
+    prompt and full_prompt can be callables, they're called at that point too. Choices are shown page_size at a time,
+    an answer that isn't a number or a command searches choices by the beginnings of their words.
+    """
+
+    page_size = 10
+
     def __init__(self, state, command, f, bag, cmd_pfx, prompt=None, full_prompt=None, empty_message=None,
                  select_subset=False, skip_single=False):
         self.bag = bag
-
-        if full_prompt:
-            self.prompt_str = full_prompt
-        else:
-            prompt = prompt or f"what to {command}"
-            self.prompt_str = f"Please choose {prompt}"
-
+        self.choice_prompt = prompt
+        self.full_prompt = full_prompt
         self.empty_message = empty_message
         self.select_subset = select_subset
         self.skip_single = skip_single
-        super(ChoiceHandler, self).__init__(state, command, f, self._get_prompt(), cmd_pfx)
+        self._display_list = None
+        self.page = 0
+        self.query = None
+        super(ChoiceHandler, self).__init__(state, command, f, None, cmd_pfx)
+
+    @property
+    def prompt_str(self):
+        full_prompt = self.full_prompt() if callable(self.full_prompt) else self.full_prompt
+        if full_prompt:
+            return full_prompt
+        prompt = self.choice_prompt() if callable(self.choice_prompt) else self.choice_prompt
+        prompt = prompt or f"what to {self.command}"
+        return f"Please choose {prompt}"
 
     def _should_abort(self):
         if not self.bag:
             return self.empty_message or self.bag.empty_message % self.command
 
     def _get_display_list(self):
-        if "bag" not in self.state:
-            self.state.update(bag=self.bag)
-        return self.state["bag"].get_display_list()
-
-    def _get_prompt(self):
+        if self._display_list is None:
+            self._display_list = self.bag.get_display_list()
+        return self._display_list
+
+    @staticmethod
+    def _get_choice_key(item):
+        # actors are told apart by their ids, commodities of a class with the same name are interchangeable
+        get_uid = getattr(item, 'get_uid', None)
+        return f"{type(item).__name__}:{get_uid() if get_uid else get_name(item)}"
+
+    def _get_choice(self, n):
+        """
+        Numbers refer to the choices shown with the prompt, which are stored as keys, not as items. An item is looked
+        up in the current bag by its key, so a stale choice gives None. Without a prompt numbers refer to the current
+        bag.
+        """
+        display_list = self._get_display_list()
+        choices = self.state.get("choices")
+        if choices is None:
+            return display_list[n][1] if n < len(display_list) else None
+        n -= self.state.get("page", 0) * self.page_size
+        if 0 <= n < len(choices):
+            return next((item for caption, item in display_list if self._get_choice_key(item) == choices[n]), None)
+
+    def _get_matches(self):
+        display_list = self._get_display_list()
+        if not self.query:
+            return display_list
+        index = CaptionIndex(caption for caption, item in display_list)
+        return [display_list[n] for n in index.find(self.query)]
+
+    def get_prompt(self):
         if self.select_subset:
             yield f"{self.prompt_str} or {self.command} {self.cmd_pfx}all:"
         else:
             yield f"{self.prompt_str}:"
 
-        for n, (caption, item) in enumerate(self._get_display_list()):
+        matches = self._get_matches()
+        pages = max(1, -(-len(matches) // self.page_size))
+        self.page = min(self.page, pages - 1)
+        start = self.page * self.page_size
+        shown = matches[start:start + self.page_size]
+
+        self.state.update(choices=[self._get_choice_key(item) for caption, item in shown])
+        if self.page:
+            self.state.update(page=self.page)
+        if self.query:
+            self.state.update(query=self.query)
+
+        if not matches:
+            yield f"Nothing matches \"{self.query}\", send another name."
+        for n, (caption, item) in enumerate(shown, start):
             yield f"{self.cmd_pfx}{n + 1:d}. {caption}"
+        if pages > 1:
+            yield f"Page {self.page + 1:d} of {pages:d}, send {self.cmd_pfx}next, {self.cmd_pfx}prev or a name to search."
 
     def _modify_arg(self, arg):
         if arg in self.bag:
             return arg
 
+        if arg is not None:
+            self.page = self.state.get("page", 0)
+            self.query = self.state.get("query")
+
+        is_cmd = self.cmd_pfx.is_cmd(arg)
         arg = self.cmd_pfx.get_cmd(arg, arg)
         if self.select_subset and arg == 'all':
             return self.bag
 
+        if arg == 'next':
+            self.page += 1
+            return
+        if arg == 'prev':
+            self.page = max(0, self.page - 1)
+            return
+        if isinstance(arg, str) and not is_cmd and not arg.isdigit():
+            self.query = arg
+            self.page = 0
+            return
+
         item = None
-        if self.skip_single and "bag" not in self.state and len(self.bag) == 1:
+        if self.skip_single and "choices" not in self.state and len(self.bag) == 1:
             item = self.bag.pop()
             self.state.clear()  # skip_single won't trigger regular clean up
 
         elif isinstance(arg, str) and arg.isdigit() and arg != '0':
-            display_list = self._get_display_list()
-            try:
-                name, item = display_list[int(arg) - 1]
-            except IndexError:
-                pass
+            item = self._get_choice(int(arg) - 1)
 
         if item:
             return item
@@ -122,6 +200,7 @@ class ChoiceChainHandler(ChoiceHandler):
         self.cmd_pfx = cmd_pfx
         self.i = 0
         self.next_step = False
+        self.failed = False
 
     @property
     def args(self):
@@ -146,6 +225,16 @@ class ChoiceChainHandler(ChoiceHandler):
         value = self.cur_step.get(key, default)
         return value(**self.args) if callable(value) else value
 
+    def get_cur_deferred(self, key):
+        """
+        Like get_cur, but a callable value is evaluated only when the result is called.
+        """
+        value = self.cur_step.get(key)
+        if callable(value):
+            args = dict(self.args)
+            return lambda: value(**args)
+        return value
+
     @property
     def skipped(self):
         if 'skipped' not in self.state:
@@ -194,14 +283,15 @@ class ChoiceChainHandler(ChoiceHandler):
 
             handler = ChoiceHandler(
                 self.input_state, self.command, self._store_choice, self.cur_bag, self.cmd_pfx,
-                prompt=self.get_cur('prompt'),
-                full_prompt=self.get_cur('full_prompt'),
+                prompt=self.get_cur_deferred('prompt'),
+                full_prompt=self.get_cur_deferred('full_prompt'),
                 empty_message=self.get_cur('empty_message'),
                 select_subset=self.get_cur('select_subset'),
                 skip_single=self.get_cur('skip_single', False))
             result = handler(arg)
 
             if handler.aborted:
+                self.failed = True
                 break
 
             if not self.next_step:
@@ -242,6 +332,17 @@ class ConfirmationHandler(InputHandler):
             return False
 
 
+class CommandTable(object):
+    def __init__(self, categories):
+        self.factories = collections.OrderedDict()  # verb -> function building a handler for a chatflow
+        self.names_by_category = collections.OrderedDict()
+        for category, commands in categories.items():
+            names = self.names_by_category[category] = []
+            for verb, factory in commands:
+                names.append(verb)
+                self.factories.setdefault(verb, factory)
+
+
 class Chatflow(mutators.ActorMutator, HumanAttacks):
     def __init__(self, actor, world, cmd_pfx=None, *args, **kwargs):
         super().__init__(actor, world, *args, **kwargs)
@@ -251,6 +352,7 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
         pass
 
     default_wear = DirtyRags
+    hibernate_after = 100  # ticks
     cooldown_announce = {
         'active': {False: ("falls asleep.", "fall asleep."), 'first': ("wakes up.", "wake up.")}
     }
@@ -258,23 +360,49 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
     def get_action(self, cls, **kwargs):
         return super().get_action(cls, cmd_pfx=self.cmd_pfx, **kwargs)
 
+    command_separator = ';'
+
     def process_message(self, text):
+        """
+        Processes a command, or a sequence of commands separated by command_separator, up to the first one that
+        fails or asks for an input.
+        """
+        for command_text in self.split_commands(text):
+            if not self.process_command(command_text):
+                break
+
+    def split_commands(self, text):
+        if not self.cmd_pfx.is_cmd(text.lstrip()):  # an answer is taken as it is
+            return [text]
+        return [command_text for command_text in text.split(self.command_separator) if command_text.strip()]
+
+    def process_command(self, text):
+        """
+        Returns True if the command succeeded and doesn't wait for an input.
+        """
         tokens = self.tokenize(text)
-        if tokens:
-            if self.actor.input:
-                self.actor.input.update(answered=text)
-
-            for command, args in self.get_command_args(*tokens):
-                try:
-                    result = self.dispatch(command, *args)
-                    self.reply(result)
-                except self.UnknownChatflowCommand:
-                    if 'answered' not in self.actor.input:
-                        self.reply(f"Unknown command. Send {self.cmd_pfx}help for the list of commands.")
-                else:
-                    if 'answered' in self.actor.input:
-                        self.actor.input.clear()
-                        self.actor.chain.clear()
+        if not tokens:
+            return False
+
+        if self.actor.input:
+            self.actor.input.update(answered=text)
+
+        succeeded = True
+        for command, args in self.get_command_args(*tokens):
+            try:
+                result = self.dispatch(command, *args)
+                self.reply(result)
+            except self.UnknownChatflowCommand:
+                if 'answered' not in self.actor.input:
+                    self.reply(f"Unknown command. Send {self.cmd_pfx}help for the list of commands.")
+                    succeeded = False
+            else:
+                succeeded = not self.failed
+                if 'answered' in self.actor.input:
+                    self.actor.input.clear()
+                    self.actor.chain.clear()
+
+        return succeeded and not self.actor.input
 
     def tokenize(self, text):
         return text.split(None, 1)
@@ -289,11 +417,15 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
             yield self.actor.input['command'], [self.actor.input['answered']]
 
     def dispatch(self, command, *args, **kwargs):
-        for cmd, handler in self.get_commands():
-            if cmd == command:
-                self.wakeup()
-                return handler(*args, **kwargs)
-        raise self.UnknownChatflowCommand
+        factory = self.get_command_table(self.actor.alive).factories.get(command)
+        if factory is None:
+            raise self.UnknownChatflowCommand
+        handler = factory(self)
+        self.wakeup()
+        self.failed = False
+        result = handler(*args, **kwargs)
+        self.failed = self.failed or getattr(handler, 'failed', False)
+        return result
 
     def reply(self, result):
         if isinstance(result, FilterSet):  # some methods return them
@@ -303,19 +435,30 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
         elif isinstance(result, collections.Iterable):
             self.actor.send("\n".join(result))
 
-    def get_commands_by_category(self):
-        if self.actor.alive:
-            return collections.OrderedDict(
-                location=self.get_location_commands(),
-                social=self.get_social_commands(),
-                inventory=self.get_inventory_commands(),
-                produce=self.get_production_commands(),
-                general=self.get_alive_general_commands())
-        else:
-            return dict(general=self.get_dead_general_commands())
+    @classmethod
+    def get_command_table(cls, alive):
+        """
+        Returns a CommandTable for alive or dead actors, built once per class.
+        """
+        tables = vars(cls).get('_command_tables')
+        if tables is None:
+            tables = cls._command_tables = {}
+        table = tables.get(alive)
+        if table is None:
+            if alive:
+                categories = collections.OrderedDict(
+                    location=cls.get_location_commands(),
+                    social=cls.get_social_commands(),
+                    inventory=cls.get_inventory_commands(),
+                    produce=cls.get_production_commands(),
+                    general=cls.get_alive_general_commands())
+            else:
+                categories = dict(general=cls.get_dead_general_commands())
+            table = tables[alive] = CommandTable(categories)
+        return table
 
-    def get_commands(self):
-        return chain.from_iterable(self.get_commands_by_category().values())
+    def get_commands_by_category(self):
+        return self.get_command_table(self.actor.alive).names_by_category
 
     def get_me_command(self):
         if self.actor.name:
@@ -323,21 +466,30 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
         else:
             return self.input('name', self.name, "You didn't introduce yourself yet. Please tell me your name.")
 
-    def get_alive_general_commands(self):
-        yield 'me', self.get_me_command()
-        yield 'restart', self.confirmation('restart', self.die, 'Do you want to restart the game?')
-        yield 'help', self.help
+    def get_name_command(self):
+        return self.input('name', self.name, "Please tell me your name.")
+
+    def get_restart_command(self):
+        return self.confirmation('restart', self.die, 'Do you want to restart the game?')
 
-    def get_dead_general_commands(self):
-        yield 'start', self.start
-        yield 'name', self.input('name', self.name, "Please tell me your name.")
-        yield 'me', self.get_me_command()
-        yield 'help', self.help
+    @classmethod
+    def get_alive_general_commands(cls):
+        yield 'me', methodcaller('get_me_command')
+        yield 'restart', methodcaller('get_restart_command')
+        yield 'help', attrgetter('help')
+
+    @classmethod
+    def get_dead_general_commands(cls):
+        yield 'start', attrgetter('start')
+        yield 'name', methodcaller('get_name_command')
+        yield 'me', methodcaller('get_me_command')
+        yield 'help', attrgetter('help')
 
-    def get_location_commands(self):
+    @classmethod
+    def get_location_commands(cls):
         for direction in Direction.all:
-            yield direction, getattr(self, direction)
-        yield 'where', self.where
+            yield direction, attrgetter(direction)
+        yield 'where', attrgetter('where')
 
     def get_look_command(self):
         return self.choice(
@@ -410,38 +562,44 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
             prompt="whom to attack",
             empty_message="There's no one here you can attack.")
 
-    def get_social_commands(self):
-        yield 'look', self.get_look_command()
-        yield 'barter', self.get_barter_command()
-        yield 'sell', self.get_sell_command()
-        yield 'buy', self.get_buy_command()
-        yield 'attack', self.get_attack_command()
-
-        attacks = set(self.organic_attacks)
-        attacks.update(cls.attack for cls in Weapon.__subclasses__())
+    def get_kick_command(self, attack):
         if not self.actor.victim:
-            for attack in attacks:
-                yield attack.verb, lambda: "You're not attacking anyone."
-        else:
-            for attack in attacks:
-                yield attack.verb, lambda: self.kick(attack)
+            return lambda: "You're not attacking anyone."
+        return lambda: self.kick(attack)
 
-    def get_inventory_commands(self):
-        yield 'bag', self.bag
-        yield self.collect.verb, self.collect
-        yield self.pick.verb, self.pick
-        yield self.drop.verb, self.drop
+    @classmethod
+    def get_social_commands(cls):
+        yield 'look', methodcaller('get_look_command')
+        yield 'barter', methodcaller('get_barter_command')
+        yield 'sell', methodcaller('get_sell_command')
+        yield 'buy', methodcaller('get_buy_command')
+        yield 'attack', methodcaller('get_attack_command')
+
+        attacks = set(cls.organic_attacks)
+        attacks.update(weapon.attack for weapon in Weapon.__subclasses__())
+        for attack in sorted(attacks, key=str):
+            yield attack.verb, methodcaller('get_kick_command', attack)
 
-        for cls in ActionClasses.__subclasses__():
-            if hasattr(self, cls.verb):
-                yield cls.verb, getattr(self, cls.verb)
+    @classmethod
+    def get_inventory_commands(cls):
+        yield 'bag', attrgetter('bag')
+        yield 'collect', attrgetter('collect')
+        yield 'pick', attrgetter('pick')
+        yield 'drop', attrgetter('drop')
 
-        yield self.unequip.verb, self.unequip
+        actions = cls.get_action_classes()
+        for action_cls in ActionClasses.__subclasses__():
+            if action_cls.verb in actions:
+                yield action_cls.verb, attrgetter(action_cls.verb)
 
-    def get_production_commands(self):
-        for cls in MeansOfProduction.__subclasses__():
-            if hasattr(self, cls.verb):
-                yield cls.verb, getattr(self, cls.verb)
+        yield 'unequip', attrgetter('unequip')
+
+    @classmethod
+    def get_production_commands(cls):
+        actions = cls.get_action_classes()
+        for means_cls in MeansOfProduction.__subclasses__():
+            if means_cls.verb in actions:
+                yield means_cls.verb, attrgetter(means_cls.verb)
 
     def input(self, cmd, f, prompt):
         return InputHandler(self.actor.input, cmd, f, prompt, cmd_pfx=self.cmd_pfx)
@@ -471,29 +629,16 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
         yield f"You {verb} {location.descr}"
 
         for means in self.location.means:
-            yield means.descr % (self.cmd_pfx + means.verb)
+            yield means.get_descr(self.cmd_pfx)
 
-        for descr, directions in location.get_exit_groups():
-            directions = (self.cmd_pfx + d for d in directions)
-            yield descr % list_sentence(directions)
+        yield from location.get_exits_descr(self.cmd_pfx)
 
-        if len(self.location.items) == 1:
-            for item in self.location.items:
-                yield f"On the ground you see {item.name}. You can {self.cmd_pfx}pick it up."
-        elif len(self.location.items) > 1:
-            items_sentence = pretty_list(self.location.items)
-            yield f"On the ground you see {items_sentence}. " \
-                  f"You can {self.cmd_pfx}pick or {self.cmd_pfx}collect them all."
+        yield from self.location.get_view(location.id, ('items', self.cmd_pfx), self.render_items)
 
         others = self.get_actor_set(self.others)
         if others:
-            if len(others) > 1:
-                yield "You see:"
-                for name, actor in others.get_display_list():
-                    yield f"  • {actor.get_full_descr(self.actor)}"
-            else:
-                actor, = others
-                yield f"You see {actor.get_full_descr(self.actor)}."
+            yield from self.location.get_view(location.id, ('actors', actor.get_uid()),
+                                              lambda: self.render_others(others))
 
             actions = [f'take a closer {self.cmd_pfx}look at them']
 
@@ -511,6 +656,33 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
             actions_sentence = list_sentence(actions, glue="or")
             yield f"You can {actions_sentence}."
 
+        sleeping = self.world.sleeping.get(location.id)
+        if sleeping == 1:
+            yield "Someone is sleeping here."
+        elif sleeping:
+            yield f"{sleeping:d} players are sleeping here."
+
+    def render_items(self):
+        items = self.location.items
+        if len(items) == 1:
+            item, = items
+            return (f"On the ground you see {item.name}. You can {self.cmd_pfx}pick it up.",)
+        elif len(items) > 1:
+            return (f"On the ground you see {pretty_list(items)}. "
+                    f"You can {self.cmd_pfx}pick or {self.cmd_pfx}collect them all.",)
+        return ()
+
+    def render_others(self, others):
+        """
+        Returns sentences about others, as the actor sees them.
+        """
+        if len(others) > 1:
+            sentences = ["You see:"]
+            sentences.extend(f"  • {actor.get_full_descr(self.actor)}" for name, actor in others.get_display_list())
+        else:
+            sentences = [f"You see {actor.get_full_descr(self.actor)}." for actor in others]
+        return tuple(sentences)
+
     def welcome(self):
         yield "Hello and welcome to this little MUD game."
 
@@ -526,7 +698,7 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
         return self.where(verb="wake up")
 
     def help(self):
-        commands_list = (self.cmd_pfx + cmd for cmd, hndlr in self.get_commands())
+        commands_list = (self.cmd_pfx + cmd for cmd in self.get_command_table(self.actor.alive).factories)
         commands_list = ", ".join(commands_list)
         return f"Known commands are: {commands_list}"
 
@@ -550,11 +722,15 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
             if actor.wields:
                 yield "You wield %s. You can %sunequip it." % (actor.wields.descr, self.cmd_pfx)
         else:
-            yield f"You see {actor.get_full_descr(self.actor)}."
-            if actor.wears:
-                yield "%s wears %s." % (actor.Name, actor.wears.descr)
-            if actor.wields:
-                yield "%s wields %s." % (actor.Name, actor.wields.descr)
+            yield from self.location.get_view(self.actor.location.id, ('look', actor.get_uid(), self.actor.get_uid()),
+                                              lambda: tuple(self.render_look(actor)))
+
+    def render_look(self, actor):
+        yield f"You see {actor.get_full_descr(self.actor)}."
+        if actor.wears:
+            yield "%s wears %s." % (actor.Name, actor.wears.descr)
+        if actor.wields:
+            yield "%s wields %s." % (actor.Name, actor.wields.descr)
 
     def bag(self):
         if not self.bag:
@@ -578,8 +754,106 @@ class Chatflow(mutators.ActorMutator, HumanAttacks):
             yield f"You can {actions_sentence} items."
             yield f"You have {credits(self.actor.credits)}."
 
+    def act(self):
+        super().act()
+        if self.actor.routine:
+            self.run_routine()
+
+    def start_routine(self, verb, times=None, until=None, until_count=None):
+        if self.actor.routine:
+            self.finish_routine()
+        self.actor.routine.update(verb=verb, times=times, until=until, until_count=until_count, done=0,
+                                  produced=CommoditySet())
+
+    def get_routine_interruption(self):
+        if self.actor.victim or any(a.victim is self.actor for a in self.location.actors):
+            return "You're attacked!"
+
+    def run_routine(self):
+        """
+        Repeats the queued action once per tick, like NPCs do their routines.
+        """
+        routine = self.actor.routine
+        if not self.actor.alive:
+            routine.clear()
+            return
+
+        interruption = self.get_routine_interruption()
+        if interruption:
+            return self.finish_routine(interruption)
+
+        until = routine.get('until')
+        if until and self.actor.bag.count(Commodity.find_class(until)) >= routine['until_count']:
+            return self.finish_routine()
+
+        if self.coolsdown('produce'):
+            return
+
+        action = getattr(self, routine['verb'])
+        result = action()
+        if action.failed:
+            return self.finish_routine(result or f"You can't {routine['verb']} anymore.")
+
+        routine['done'] += 1
+        if routine.get('times') is not None and routine['done'] >= routine['times']:
+            self.finish_routine()
+
+    def finish_routine(self, reason=None):
+        routine = self.actor.routine
+        verb, done, produced = routine['verb'], routine['done'], routine['produced']
+        routine.clear()
+
+        if not done:
+            summary = f"You haven't got to {verb}."
+        else:
+            times = "once" if done == 1 else f"{done:d} times"
+            summary = f"You {verb} {times} and get {produced}."
+        self.actor.send(f"{reason} {summary}" if reason else summary)
+
+    def _set(self, counters, counter, value, announce=None):
+        result = super()._set(counters, counter, value, announce)
+        if counter == 'active':
+            self.update_listening()
+        return result
+
+    def _dec(self, counters, counter, announce=None):
+        result = super()._dec(counters, counter, announce)
+        if counter == 'active' and result:
+            self.update_listening()
+            self.set_cooldown('asleep', self.hibernate_after)
+        elif counter == 'asleep' and result:
+            self.hibernate()
+        return result
+
+    def hibernate(self):
+        """
+        Takes a sleeping player out of the location, only a number of sleeping players is kept there. Players who
+        fight or go on with a routine stay until they're done.
+        """
+        if not self.actor.alive or self.actor not in self.location.actors:
+            return
+        if self.actor.routine or self.actor.victim or any(a.victim is self.actor for a in self.others):
+            self.set_cooldown('asleep', 1)  # try again later
+            return
+        location_id = self.actor.location.id
+        self.location.actors.remove(self.actor)
+        self.update_listening()
+        self.world.sleeping[location_id] = self.world.sleeping.get(location_id, 0) + 1
+
+    def restore(self):
+        location_id = self.actor.location.id
+        self.location.actors.add(self.actor)
+        sleeping = self.world.sleeping.get(location_id, 0) - 1
+        if sleeping > 0:
+            self.world.sleeping[location_id] = sleeping
+        else:
+            self.world.sleeping.pop(location_id, None)
+
     def wakeup(self, announce=None):  # called from dispatch
         if self.actor.alive:
+            if self.actor not in self.location.actors:
+                self.restore()
+            self.actor.cooldown.pop('asleep', None)
             self.set_cooldown('active', 20, announce)
 
     def spawn(self, location):
@@ -633,14 +907,16 @@ class GoPlayerAction(PlayerAction, mutators.GoAction):
 
 
 class ChooseCommodityAction(mutators.Action):
-    @property
-    def after_checks(self):
-        return self.choice(
+    def after_checks(self, *args):
+        handler = self.choice(
             self.verb,
             super().after_checks,
             CommoditySet(self.get_args()),
             skip_single=self.skip_single,
             select_subset=True)
+        result = handler(*args)
+        self.failed = self.failed or handler.failed
+        return result
 
 
 class BasePickPlayerAction(PlayerAction, mutators.PickAction):
@@ -694,19 +970,55 @@ class ItemToSlotPlayerAction(mutators.ItemToSlotAction, ItemPlayerAction):  # or
 
 @Chatflow.actions(MeansOfProduction.__subclasses__())
 class ProducePlayerAction(mutators.ProduceAction, PlayerAction):
+    routine_syntax = re.compile(r'^(?:x?(?P<times>\d+)|until (?P<until_count>\d+) (?P<until>.+)|(?P<stop>stop))$')
+
+    def __call__(self, arg=None):
+        if arg is None:
+            return super().__call__()
+
+        self.failed = True
+        match = self.routine_syntax.match(arg.strip().lower())
+        found = match and match.group('until') and Commodity.find_classes(match.group('until'))
+        times = match and match.group('times') and int(match.group('times'))
+        if not match or match.group('until') and not found or times is not None and times < 1:
+            return (f"You can {self.cmd_pfx}{self.verb} x10 to {self.verb} 10 times "
+                    f"or {self.cmd_pfx}{self.verb} until 5 vegetables.")
+        if found and len(found) > 1:
+            return f"Which one do you mean: {list_sentence([c().name for c in found], 'or')}?"
+        until = found and found[0]
+        if until and until not in self.means_cls.products:
+            return f"You can't {self.verb} {until().name}."
+        if match.group('stop'):
+            if self.actor.routine.get('verb') == self.verb:
+                self.finish_routine()
+            return
+        if not self.is_available:
+            return self.error_unavailable()
+
+        self.failed = False
+        until_count = int(match.group('until_count')) if until else None
+        self.start_routine(self.verb, times, until and until.__name__, until_count)
+        return f"You start to {self.verb}. You can {self.cmd_pfx}{self.verb} stop."
+
     def error_missing(self, missing):
         return f"You need {pretty_list(missing)} to {self.verb}."
         return False
 
+    def on_success(self, fruits):
+        super().on_success(fruits)
+        if self.actor.routine.get('verb') == self.verb:
+            self.actor.routine['produced'].update(fruits)
+
     def on_done(self, fruits):
         return f"You {self.verb} {fruits}. You put {fruits.pronoun} into your {self.cmd_pfx}bag."
 
 
-class CommoditySet(FilterSet):
+class CommoditySet(StackedFilterSet):
     empty_message = "Nothing to %s."
 
     def get_display_list(self):
-        return list(group_by_class(self))
+        # choosing a stack of fungible commodities means choosing one unit of it
+        return [(caption, unit(item)) for caption, item in group_by_class(self)]
 
 
 class ActorSet(FilterSet):
@@ -732,11 +1044,12 @@ class ActorSet(FilterSet):
 
 
 class PlayerState(ActorState):
+    __slots__ = ('send', 'cmd_pfx', 'last_location', 'input', 'chain', 'counters', 'routine')
     mutator_class = Chatflow
     definite_name = '(player)'
 
-    def get_mutator(self, world):
-        return Chatflow(self, world, self.cmd_pfx)
+    def create_mutator(self, world):
+        return self.mutator_class(self, world, self.cmd_pfx)
 
     def __init__(self, send_callback, cmd_pfx):
         super().__init__()
@@ -745,6 +1058,7 @@ class PlayerState(ActorState):
         self.last_location = None
         self.input = {}
         self.chain = {}
+        self.routine = {}  # an action queued to repeat every tick
         self.counters = {}  # TODO: remove after migrating to v. 9
 
     @property
@@ -16,15 +16,25 @@ class MeansOfProduction:
     optional_tools = set()
     required_tools = set()
     required_materials = {}
+    products = {}  # commodity class -> weight
+    _descrs = {}  # (class, command prefix) -> description
+
+    @classmethod
+    def get_descr(cls, cmd_pfx):
+        descr = cls._descrs.get((cls, cmd_pfx))
+        if descr is None:
+            descr = cls._descrs[cls, cmd_pfx] = cls.descr % (cmd_pfx + cls.verb)
+        return descr
 
 
 class Land(MeansOfProduction):
     descr = "The land seems arable to %s."
     verb = Verb('farm', third='farms')
     optional_tools = {Shovel}
+    products = {Vegetable: 1, Cotton: .1}
 
     def get_product(self):
-        return weighted_choice({Vegetable: 1, Cotton: .1})
+        return weighted_choice(self.products)
 
     def produce(self, tools, materials):
         result = []
@@ -40,6 +50,7 @@ class Distaff(MeansOfProduction):
 
     required_tools = {Spindle}
     required_materials = {Cotton: 2}
+    products = {RoughspunTunic: 1}
 
     def produce(self, tools, materials):
         return RoughspunTunic()
@@ -48,6 +59,7 @@ class Distaff(MeansOfProduction):
 class Workbench(MeansOfProduction):
     descr = "There's a workbench. You can %s something useful."
     verb = Verb('make', third="makes")
+    products = {Shovel: 1}
 
     def produce(self, tools, materials):
         return Shovel()
@@ -1,14 +1,14 @@
+from random import getrandbits
+
 from . import commodities
-from .utils import FilterSet
+from .utils import StackedFilterSet
 
 
 class State(object):
+    __slots__ = ()
     icon = None
     abstract_name = None
 
-    def __init__(self):
-        self.cooldown = {}
-
     @property
     def name_without_icon(self):
         return self.abstract_name
@@ -28,27 +28,36 @@ class State(object):
 
 
 class ActorState(State):
+    __slots__ = ('cooldown', '_name', 'alive', 'location', 'bag', 'credits', 'wears', 'wields', 'victim',
+                 'attack_queue', 'hitpoints', 'uid', '_mutator')
     definite_name = None
-    _name = None
     abstract_descr = None
     barters = False
     sells = False
     buys = False
     recieves_announces = False
     max_hitpoints = None
+    mutator_class = None
 
     def __init__(self, name=None):
-        super(ActorState, self).__init__()
+        self.cooldown = {}
         self.name = name
         self.alive = False
         self.location = None
-        self.bag = FilterSet()
+        self.bag = StackedFilterSet()
         self.credits = 0
         self.wears = None
         self.wields = None
         self.victim = None
         self.attack_queue = []
         self.hitpoints = 0
+        self.uid = None  # given on first use, tells apart actors with the same name
+        self._mutator = None
+
+    def get_uid(self):
+        if self.uid is None:
+            self.uid = '%08x' % getrandbits(32)
+        return self.uid
 
     @property
     def name_without_icon(self):
@@ -80,6 +89,19 @@ class ActorState(State):
         doing_descr = self.get_doing_descr(perspective)
         return f"{self.descr} {doing_descr}" if doing_descr else self.descr
 
+    def create_mutator(self, world):
+        return self.mutator_class(self, world)
+
+    def get_mutator(self, world):
+        if self.mutator_class is None:
+            return None
+        mutator = self._mutator
+        if mutator is None:
+            mutator = self._mutator = self.create_mutator(world)
+        elif mutator.actor is not self or mutator.world is not world:
+            mutator.bind(self, world)
+        return mutator
+
     @property
     def weapon(self):
         return self.wields if self.wields and isinstance(self.wields, commodities.Weapon) else None
@@ -1,3 +1,5 @@
+from bisect import bisect_left
+from collections import defaultdict
 from itertools import groupby
 
 
@@ -74,14 +76,16 @@ def pretty_list(item_or_items):
     """
 
     if hasattr(item_or_items, 'name'):
-        return item_or_items.name
-
-    items = list(item_or_items)
+        if quantity(item_or_items) == 1:
+            return item_or_items.name
+        items = [item_or_items]
+    else:
+        items = list(item_or_items)
 
     if len(items) == 0:
         return 'nothing'
 
-    if len(items) == 1:
+    if len(items) == 1 and quantity(items[0]) == 1:
         return items.pop(0).name
 
     return list_sentence(label for label, speciment in group_by_class(items))
@@ -94,22 +98,154 @@ def get_name(i):
         return i.name
 
 
+def is_fungible(item):
+    return getattr(item, 'fungible', False)
+
+
+def quantity(item):
+    return item.count if is_fungible(item) else 1
+
+
+def unit(item):
+    return item.stack() if is_fungible(item) else item
+
+
 def group_by_class(items):
     items = sorted(items, key=lambda i: type(i).__name__)
     grouped = groupby(items, lambda i: (type(i), get_name(i)))
     for (cls, name), group in grouped:
         group = list(group)
-        count = len(group)
+        count = sum(quantity(i) for i in group)
 
         specimen = group[0]
-        if count > 1 and hasattr(specimen, 'plural'):
-            if callable(specimen.plural):
-                yield specimen.plural(count), specimen
+        plural = getattr(specimen, 'plural', None)
+        if count > 1 and plural:
+            if callable(plural):
+                yield plural(count), specimen
             else:
-                yield specimen.plural % count, specimen
+                yield plural % count, specimen
         else:
             for item in group:
-                yield name, item
+                for _ in range(quantity(item)):
+                    yield name, item
+
+
+def render(message):
+    return message() if callable(message) else message
+
+
+class LazyMessage(object):
+    """
+    A message formatted by f when it's converted to str for the first time.
+
+    >>> message = LazyMessage(lambda: print("formatting...") or "Hello!")
+    >>> message.is_formatted
+    False
+    >>> str(message), str(message)
+    formatting...
+    ('Hello!', 'Hello!')
+    >>> message.is_formatted
+    True
+    """
+    __slots__ = ('f', 'text')
+
+    def __init__(self, f):
+        self.f = f
+        self.text = None
+
+    @property
+    def is_formatted(self):
+        return self.text is not None
+
+    def __str__(self):
+        if self.text is None:
+            self.text = render(self.f)
+            self.f = None
+        return self.text
+
+
+class Announcement(str):
+    """
+    Text of a broadcast announcement, with a movement event (actor, source, destination) if it's about one.
+    """
+
+    def __new__(cls, value, event=None):
+        self = super().__new__(cls, value)
+        self.event = event
+        return self
+
+
+def digest(messages):
+    """
+    Drops repeated announcements and merges movements of an actor, so that one who came and went is mentioned once
+    and one who went and came back isn't mentioned at all. Other messages are kept as they are.
+
+    >>> Place, Actor = type('Place', (object,), {}), type('Actor', (object,), dict(Name='Jack'))
+    >>> jack, field, village, woods = Actor(), Place(), Place(), Place()
+    >>> field.name, village.name, woods.name = 'a field', 'a village', 'woods'
+    >>> list(digest([
+    ...     Announcement('Jack arrives from a field.', (jack, field, None)),
+    ...     'You are in a village.',
+    ...     Announcement('A rat is hungry.'),
+    ...     Announcement('Jack leaves to woods.', (jack, None, woods)),
+    ...     Announcement('A rat is hungry.')]))
+    ['Jack passes by from a field to woods.', 'You are in a village.', 'A rat is hungry.']
+    >>> list(digest([
+    ...     Announcement('Jack leaves to woods.', (jack, None, woods)),
+    ...     Announcement('Jack arrives from woods.', (jack, woods, None))]))
+    []
+    >>> list(digest([
+    ...     Announcement('Jack leaves to woods.', (jack, None, woods)),
+    ...     Announcement('Jack arrives from woods.', (Actor(), woods, None))]))
+    ['Jack leaves to woods.', 'Jack arrives from woods.']
+    """
+    result = []
+    seen = set()
+    moves = {}  # actor -> index of its movement in result
+    for message in messages:
+        if not isinstance(message, Announcement):
+            result.append(message)
+            continue
+        if message.event is None:
+            if message not in seen:
+                seen.add(message)
+                result.append(message)
+            continue
+
+        actor, source, destination = message.event
+        i = moves.get(actor)
+        if i is None:
+            moves[actor] = len(result)
+            result.append(message)
+            continue
+        came_from, went_to = result[i].event[1], result[i].event[2]
+        if came_from is None and source is not None:  # went away and came back
+            result[i] = None
+            del moves[actor]
+        elif went_to is None and destination is not None:  # came and went away
+            result[i] = Announcement(f"{actor.Name} passes by from {came_from.name} to {destination.name}.",
+                                     (actor, came_from, destination))
+        else:
+            result.append(message)
+    return (message for message in result if message is not None)
+
+
+def all_subclasses(cls):
+    """
+    >>> A = type('A', (object,), {})
+    >>> B, C = type('B', (A,), {}), type('C', (A,), {})
+    >>> D = type('D', (B, C), {})
+    >>> [c.__name__ for c in all_subclasses(A)]
+    ['B', 'D', 'C']
+    """
+    seen = set()
+    queue = list(reversed(cls.__subclasses__()))
+    while queue:
+        subclass = queue.pop()
+        if subclass not in seen:
+            seen.add(subclass)
+            yield subclass
+            queue.extend(reversed(subclass.__subclasses__()))
 
 
 class FilterSet(set):
@@ -119,11 +255,260 @@ class FilterSet(set):
     def __str__(self):
         return pretty_list(self)
 
+    def count(self, cls):
+        return sum(1 for i in self.filter(cls))
+
     @property
     def pronoun(self):
         return "them" if len(self) > 1 else "it"
 
 
+class IndexedFilterSet(FilterSet):
+    """
+    A FilterSet that keeps its items indexed by type, so filter() only visits matching items.
+
+    >>> s = IndexedFilterSet([1, 2, 'a', 3.0])
+    >>> sorted(s.filter(int)), list(s.filter(str)), s.count(object)
+    ([1, 2], ['a'], 4)
+    >>> s.difference_update([1, 'a'])
+    >>> s.add('b')
+    >>> s -= {'b'}
+    >>> sorted(s.filter(int)), list(s.filter(str)), s.count(int), s.count(object)
+    ([2], [], 1, 2)
+    >>> s == {2, 3.0}
+    True
+    """
+
+    def __init__(self, iterable=(), observer=None):
+        super().__init__()
+        self.by_type = defaultdict(set)
+        self.observer = observer  # called with an item and a change of its quantity in the set
+        self.update(iterable)
+
+    def _notify(self, item, change):
+        if self.observer is not None:
+            self.observer(item, change)
+
+    def _types(self, cls):
+        return (t for t in self.by_type if issubclass(t, cls))
+
+    def filter(self, cls):
+        return (i for t in list(self._types(cls)) for i in self.by_type[t])
+
+    def count(self, cls):
+        return sum(len(self.by_type[t]) for t in self._types(cls))
+
+    def _index_discard(self, item):
+        items = self.by_type.get(type(item))
+        if items is not None and item in items:
+            items.discard(item)
+            if not items:
+                del self.by_type[type(item)]
+            self._notify(item, -quantity(item))
+
+    def add(self, item):
+        if not set.__contains__(self, item):
+            super().add(item)
+            self.by_type[type(item)].add(item)
+            self._notify(item, quantity(item))
+
+    def remove(self, item):
+        super().remove(item)
+        self._index_discard(item)
+
+    def discard(self, item):
+        super().discard(item)
+        self._index_discard(item)
+
+    def pop(self):
+        item = super().pop()
+        self._index_discard(item)
+        return item
+
+    def clear(self):
+        if self.observer is not None:
+            for item in self:
+                self._notify(item, -quantity(item))
+        super().clear()
+        self.by_type.clear()
+
+    def update(self, *iterables):
+        for iterable in iterables:
+            for item in iterable:
+                self.add(item)
+
+    def difference_update(self, *iterables):
+        for iterable in iterables:
+            if iterable is self:
+                self.clear()
+                continue
+            for item in iterable:
+                self.discard(item)
+
+    def intersection_update(self, *iterables):
+        keep = set(self).intersection(*iterables)
+        self.difference_update([item for item in self if item not in keep])
+
+    def symmetric_difference_update(self, iterable):
+        for item in set(iterable):
+            if item in self:
+                self.discard(item)
+            else:
+                self.add(item)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+
+class StackedFilterSet(IndexedFilterSet):
+    """
+    An IndexedFilterSet that keeps fungible items as a single stack per type and counts units, not instances.
+
+    >>> from mud.commodities import Vegetable, Spindle
+    >>> veg, spindle = Vegetable(), Spindle()
+    >>> s = StackedFilterSet([veg, Vegetable(), spindle])
+    >>> len(s), s.count(Vegetable), veg in s, Vegetable() in s, str(s)
+    (3, 2, True, True, '🌀 a spindle and 🥕 2 vegetables')
+    >>> s.remove(veg)
+    >>> taken = s.take([Vegetable.stack(5), spindle])
+    >>> len(taken), len(s), s.count(Vegetable), veg in s
+    (2, 0, 0, False)
+    """
+
+    def __init__(self, iterable=(), observer=None):
+        self.stacks = {}
+        super().__init__(iterable, observer)
+
+    def __len__(self):
+        return super().__len__() + sum(stack.count - 1 for stack in self.stacks.values())
+
+    def __contains__(self, item):
+        if is_fungible(item):
+            return type(item) in self.stacks
+        return super().__contains__(item)
+
+    def count(self, cls):
+        return sum(quantity(i) for i in self.filter(cls))
+
+    def quantity_of(self, item):
+        if is_fungible(item):
+            stack = self.stacks.get(type(item))
+            return stack.count if stack else 0
+        return 1 if item in self else 0
+
+    def add(self, item):
+        if not is_fungible(item):
+            return super().add(item)
+        if self.stacks.get(type(item)) is not item:
+            self._add_units(type(item), item.count)
+
+    def _add_units(self, cls, count):
+        stack = self.stacks.get(cls)
+        if stack is None:
+            # a new stack, so that it's never shared with another container
+            stack = self.stacks[cls] = cls.stack(count)
+            super().add(stack)
+        else:
+            stack.count += count
+            self._notify(stack, count)
+
+    def _remove_units(self, stack, count):
+        if count < stack.count:
+            stack.count -= count
+            self._notify(stack, -count)
+        else:
+            del self.stacks[type(stack)]
+            super().discard(stack)
+
+    def remove(self, item):
+        if not is_fungible(item):
+            return super().remove(item)
+        if type(item) not in self.stacks:
+            raise KeyError(item)
+        self._remove_units(self.stacks[type(item)], item.count)
+
+    def discard(self, item):
+        if not is_fungible(item):
+            return super().discard(item)
+        if type(item) in self.stacks:
+            self._remove_units(self.stacks[type(item)], item.count)
+
+    def pop(self):
+        item = next(iter(self))
+        if is_fungible(item) and item.count > 1:
+            self._remove_units(item, 1)
+            return item.stack()
+        self.remove(item)
+        return item
+
+    def clear(self):
+        super().clear()
+        self.stacks.clear()
+
+    def take(self, items, dry=False):
+        """
+        Removes items, or as many units of fungible ones as there are, and returns what was removed.
+        """
+        source = StackedFilterSet(self) if dry else self
+        taken = StackedFilterSet()
+        for item in items:
+            if is_fungible(item):
+                stack = source.stacks.get(type(item))
+                if stack is not None:
+                    count = min(item.count, stack.count)
+                    taken._add_units(type(item), count)
+                    source._remove_units(stack, count)
+            elif item in source:
+                source.remove(item)
+                taken.add(item)
+        return taken
+
+
+class CaptionIndex(object):
+    """
+    Positions of captions by their words, so that a search by word prefixes is a binary search.
+
+    >>> index = CaptionIndex(['🥕 5 vegetables', '🍄 a mushroom', '🌀 a spindle'])
+    >>> index.find('SPIN'), index.find('a'), index.find('a mu'), index.find('x')
+    ([2], [1, 2], [1], [])
+    """
+
+    def __init__(self, captions):
+        self.words = sorted((word.lower(), n) for n, caption in enumerate(captions) for word in caption.split())
+        self.keys = [word for word, n in self.words]
+
+    def find_prefix(self, prefix):
+        found = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            found.add(self.words[i][1])
+            i += 1
+        return found
+
+    def find(self, query):
+        """
+        Returns sorted positions of captions that have a word starting with every word of query.
+        """
+        found = None
+        for prefix in query.lower().split():
+            matches = self.find_prefix(prefix)
+            found = matches if found is None else found & matches
+        return sorted(found or ())
+
+
 class Verb(str):
     def __new__(cls, value, third):
         self = super().__new__(cls, value)
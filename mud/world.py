@@ -1,25 +1,128 @@
+from collections import defaultdict, Counter
 from itertools import chain
 
-from .locations import Location, Field, Woods, Forests
+from .locations import Location, Region, Field, Woods, Forests
 from .commodities import Commodity, Mushroom
 from .npcs import NpcState, RatState
-from .utils import FilterSet
+from .utils import IndexedFilterSet, StackedFilterSet, LazyMessage
 
-from random import choice
+from random import choice, getrandbits
+
+
+class SpawnRule(object):
+    """
+    Keeps population of cls (items on the ground or actors) in region between min and max.
+
+    Below min_population one specimen spawns every tick, up to max_population one spawns every cooldown ticks.
+    Population and the time of the last spawn are kept per rule key, which is the class name unless a name is given,
+    so that rules for one class in different regions need names.
+    """
+
+    def __init__(self, cls, region, locations=None, min_population=1, max_population=None, cooldown=0, name=None):
+        self.cls = cls
+        self.key = name or cls.__name__
+        self.region = frozenset(location.id for location in region)
+        self.locations = list(locations or (Location.all[location_id] for location_id in self.region))
+        self.min_population = min_population
+        self.max_population = max(max_population or min_population, min_population)
+        self.cooldown = cooldown
+
+    def apply(self, world):
+        population = world.population[self.key]
+        if population >= self.max_population:
+            return
+        if population >= self.min_population and world.time - world.spawned.get(self.key, 0) < self.cooldown:
+            return
+        world.spawn(self.cls, choice(self.locations))
+        world.spawned[self.key] = world.time
+
+
+class SpawnTable(object):
+    def __init__(self, *rules):
+        keys = [rule.key for rule in rules]
+        for key in keys:
+            if keys.count(key) > 1:
+                raise Exception('Spawn rule %s exists' % key)
+        self.rules = rules
+        self._keys = {}
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def get_keys(self, location_id, cls):
+        """
+        Returns keys of population counters that an instance of cls in location counts towards.
+        """
+        keys = self._keys.get((location_id, cls))
+        if keys is None:
+            keys = self._keys[location_id, cls] = tuple(
+                rule.key for rule in self.rules
+                if location_id in rule.region and issubclass(cls, rule.cls))
+        return keys
+
+
+spawn_table = SpawnTable(
+    SpawnRule(Mushroom, Forests.values()),
+    SpawnRule(RatState, chain([Field], Woods.values()), locations=Woods.values()))
 
 
 class WorldState(dict):
+    __slots__ = ('time', 'spawned', 'sleeping', 'entity_keys', 'population', 'message_stats', 'last_message_stats',
+                 'chunks', 'chunk_loader')
+
     def __init__(self):
         self.time = 0
+        self.spawned = {}  # rule key -> time of the last spawn
+        self.sleeping = {}  # location id -> number of players hibernated there
+        self.entity_keys = {}  # class name -> the last key given to an entity, some may be in chunks not loaded
+        self.population = defaultdict(int)  # rule key -> count, maintained by location states
+        self.message_stats = Counter()  # 'formatted' and 'suppressed' announcements of the current tick
+        self.last_message_stats = Counter()
+        self.chunks = set()  # chunks of generated regions loaded so far
+        self.chunk_loader = None  # callable that loads states of the locations of a chunk
 
     def __getitem__(self, key):
         value = self.get(key, None)
         if value is None:
-            if key not in Location.all.keys():
-                raise KeyError
-            value = self[key] = LocationState()
+            location = Location.get(key)
+            if location.chunk is not None and location.chunk not in self.chunks:
+                self.load_chunk(location.chunk)
+                return self[key]
+            value = self[key] = LocationState(observer=self.get_population_observer(key))
         return value
 
+    def load_chunk(self, chunk):
+        if chunk in self.chunks:
+            return
+        self.chunks.add(chunk)
+        if self.chunk_loader:
+            self.chunk_loader(chunk)
+
+    def get_active_chunks(self):
+        """
+        Chunks near active players, to be loaded along with the world by the next request.
+        """
+        chunks = set()
+        for location_id, state in self.items():
+            chunk = Location.all[location_id].chunk
+            if chunk is not None and state.listeners:
+                chunks.update(Region.all[chunk[0]].get_neighbour_chunks(chunk))
+        return chunks
+
+    def get_population_observer(self, location_id):
+        def observer(item, change):
+            for key in spawn_table.get_keys(location_id, type(item)):
+                self.population[key] += change
+        return observer
+
+    @property
+    def is_idle(self):
+        """
+        Nobody watches the world and nobody goes on with a routine, i.e. no player is active.
+        """
+        return not any(location.listeners or any(getattr(actor, 'routine', None) for actor in location.actors)
+                       for location in self.values())
+
     def actors(self):
         return (a for l in self.values() for a in l.actors)
 
@@ -28,7 +131,7 @@ class WorldState(dict):
             item = cls()
             where = self[where.id]
             where.items.add(item)
-            where.broadcast(f"{item.Name} materializes.")
+            where.broadcast(LazyMessage(lambda: f"{item.Name} materializes."))
         elif issubclass(cls, NpcState):
             npc = cls()
             npc.get_mutator(self).spawn(where)
@@ -37,6 +140,7 @@ class WorldState(dict):
 
     def enact(self):
         self.time = self.time or 0
+        self.message_stats = Counter()
 
         # actors can change location so take a set
         mutators = set(a.get_mutator(self) for a in self.actors())
@@ -50,27 +154,76 @@ class WorldState(dict):
         for mutator in mutators:
             mutator.cleanup_victims()
 
-        # mushrooms
-        mushrooms = list(c for l in Forests.values() for c in self[l.id].items.filter(Mushroom))
-        if not mushrooms:
-            self.spawn(Mushroom, choice(list(Forests.values())))
-
-        # rat
-        rat_locations = set(chain([Field], Woods.values()))
-        if not any(chain.from_iterable(self[loc.id].actors.filter(RatState) for loc in rat_locations)):
-            self.spawn(RatState, choice(list(Woods.values())))
+        for rule in spawn_table:
+            rule.apply(self)
 
+        self.last_message_stats = self.message_stats
         self.time += 1
 
 
 class LocationState(object):
-    def __init__(self):
-        self.items = FilterSet()
-        self.actors = FilterSet()
-        self.means = FilterSet()
+    __slots__ = ('items', 'actors', 'means', 'gatekeepers', '_listeners', 'version')
+    _views = {}  # (location id, version, key) -> rendered fragment, shared by all requests of the process
+    max_views = 4096
+
+    def __init__(self, observer=None):
+        def on_change(item, change):
+            self.bump_version()
+            if observer is not None:
+                observer(item, change)
+
+        def on_actors_change(actor, change):
+            on_change(actor, change)
+            if actor.mutator_class is not None and actor.mutator_class.is_gatekeeper:
+                if change > 0:
+                    self.gatekeepers.add(actor)
+                else:
+                    self.gatekeepers.discard(actor)
+
+        self.gatekeepers = set()  # actors whose mutators allow others to leave or not
+        self.items = StackedFilterSet(observer=on_change)
+        self.actors = IndexedFilterSet(observer=on_actors_change)
+        self.means = IndexedFilterSet()
+        self._listeners = None
+        self.version = None  # changes with items, actors or what actors are doing
+
+    def bump_version(self):
+        # random rather than counted, so that a change that's never saved can't reuse the version of another one
+        self.version = '%016x' % getrandbits(64)
+
+    def get_view(self, location_id, key, render):
+        """
+        Returns the result of render, which is kept by the process until the location changes.
+        """
+        if self.version is None:  # never changed since it was saved without a version
+            return render()
+        key = (location_id, self.version) + key
+        view = self._views.get(key)
+        if view is None:
+            if len(self._views) >= self.max_views:
+                self._views.clear()
+            view = self._views[key] = render()
+        return view
+
+    @property
+    def listeners(self):
+        """
+        Actors that receive announces, built from actors on first access and then kept up to date by mutators.
+        """
+        if self._listeners is None:
+            self._listeners = {actor for actor in self.actors if actor.recieves_announces}
+        return self._listeners
+
+    def update_listener(self, actor):
+        if self._listeners is None:
+            return
+        if actor.recieves_announces and actor in self.actors:
+            self._listeners.add(actor)
+        else:
+            self._listeners.discard(actor)
 
     def broadcast(self, message, skip_senders=None):
-        for actor in self.actors:
-            if skip_senders and actor in skip_senders or not actor.recieves_announces:
+        for actor in self.listeners:
+            if skip_senders and actor in skip_senders:
                 continue
-            actor.send(message)
+            actor.send(str(message))
@@ -16,6 +16,7 @@ if [[ ! -d $virtualenv ]]; then
 fi
 . $virtualenv/bin/activate
 pip install -r requirments.txt
+IS_PLAYGROUND=1 python bot.py set_webhook
 
 # run ssh tunnel
 ssh -N -R 8080:localhost:5000 bakunin.nl &
@@ -32,5 +33,5 @@ if [[ $1 == '--uwsgi' ]]; then
 		--virtualenv $virtualenv
 else
 	# run local server
-	FLASK_APP=app.py FLASK_DEBUG=1 IS_PLAYGROUND=1 flask run
+	IS_PLAYGROUND=1 python app.py
 fi
\ No newline at end of file
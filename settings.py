@@ -5,6 +5,8 @@ CERT = '/usr/local/etc/nginx/cert.pem'
 WEBHOOK_HOST = 'webhooks.bakunin.nl/mud'
 REDIS = {'host': 'localhost', 'port': 6379}
 CYCLE_SECONDS = 10
+IDLE_STEP = 6  # only every IDLE_STEP-th cycle is enacted while the world is idle
+SESSION_TTL = 30 * 24 * 60 * 60  # player sessions of abandoned chats expire
 
 if getenv('IS_PLAYGROUND') or uname()[0] == "Darwin":
     IS_PLAYGROUND = True
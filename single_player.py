@@ -47,11 +47,11 @@ if __name__ == '__main__':
     player = storage.get_player_state(PLAYER_CHATKEY)
     player.name = 'Andrey'
     player.bag.update([Shovel(), Mushroom(), RoughspunTunic()])
-    Chatflow(player, storage.world).start()
+    player.get_mutator(storage.world).start()
 
     observer = storage.get_player_state(OBSERVER_CHATKEY)
     observer.name = 'A silent observer'
-    Chatflow(observer, storage.world).spawn(StartLocation)
+    observer.get_mutator(storage.world).spawn(StartLocation)
 
     # peasant = PeasantState()
     # peasant.name = 'Jack'
@@ -89,7 +89,7 @@ if __name__ == '__main__':
             storage.world.enact()
             observe("World time: %d" % storage.world.time)
         else:
-            chatflow = Chatflow(storage.get_player_state(PLAYER_CHATKEY), storage.world, cmd_pfx=cmd_pfx)
+            chatflow = storage.get_player_state(PLAYER_CHATKEY).get_mutator(storage.world)
             chatflow.process_message(s)
 
         storage.save()
@@ -101,7 +101,7 @@ if __name__ == '__main__':
 
         print(fore.DARK_GREEN
               + repr(
-                  {cat: [n for n, f in commands] for cat, commands in chatflow.get_commands_by_category().items()})
+                  dict(chatflow.get_commands_by_category()))
               + style.RESET)
 
         if cmds:
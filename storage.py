@@ -1,12 +1,15 @@
 from redis import StrictRedis
+from collections import defaultdict
+from itertools import chain
 import pprint
 
 from mud.player import PlayerState, ActorSet, CommoditySet  # noqa: F401
 from mud.world import WorldState
 from mud.npcs import NpcState, HumanNpcState
-from mud.locations import Location
+from mud.locations import Location, Region, world_map
 from mud.production import MeansOfProduction
 from mud.commodities import Commodity
+from mud.utils import all_subclasses
 
 import settings
 
@@ -24,26 +27,74 @@ class RedisStorage(object):
         return redis
 
 
+class IdleClock(RedisStorage):
+    """
+    Counts timer ticks while the world is idle, so that most of them don't even load it.
+    """
+    _idle_key = "idle_ticks"
+    # a save may delete the key at any moment, INCR alone would bring it back and make the world idle
+    _incr_if_idle = """
+        if redis.call('exists', KEYS[1]) == 1 then
+            return redis.call('incr', KEYS[1])
+        end
+    """
+
+    def skip_tick(self, every):
+        ticks = self.redis.eval(self._incr_if_idle, 1, self._idle_key)
+        if ticks is None:  # the world isn't idle
+            return False
+        return ticks % every != 0
+
+
 class PlayerSessionsStorage(RedisStorage):
     _player_session_key = "player_session:%s"
 
     class PlayerSession(object):
-        def __init__(self, redis, player_key):
+        """
+        Session is read with a single HGETALL on first access and written with a single HMSET on flush.
+        """
+
+        def __init__(self, redis, player_key, ttl=None):
             self.redis = redis
             self.player_key = player_key
+            self.ttl = ttl
+            self._values = None
+            self.changed = {}
+
+        @property
+        def values(self):
+            if self._values is None:
+                self._values = {k.decode(): v.decode() for k, v in self.redis.hgetall(self.player_key).items()}
+            return self._values
 
         def get(self, key, default=None):
-            value = self.redis.hget(self.player_key, key)
-            if value is None:
-                return default
-            else:
-                return value.decode()
+            return self.values.get(key, default)
 
         def set(self, key, value):
-            return self.redis.hset(self.player_key, key, value)
+            self.values[key] = str(value)
+            self.changed[key] = value
+
+        def flush(self, pipeline=None):
+            """
+            Writes changes and refreshes the TTL even if nothing changed, as a part of pipeline if given.
+            """
+            if not self.changed and not self.ttl:
+                return
+            redis = pipeline or self.redis.pipeline()
+            if self.changed:
+                redis.hmset(self.player_key, self.changed)
+            if self.ttl:
+                redis.expire(self.player_key, self.ttl)
+            if pipeline is None:
+                redis.execute()
+            self.changed = {}
+
+    def __init__(self, redis=None, ttl=None):
+        super().__init__(redis)
+        self.ttl = ttl
 
     def get_session(self, key):
-        return self.PlayerSession(self.redis, self._player_session_key % key)
+        return self.PlayerSession(self.redis, self._player_session_key % key, self.ttl)
 
 
 class Storage(RedisStorage):
@@ -53,6 +104,12 @@ class Storage(RedisStorage):
     _location_key = "location:%s"
     _entity_key = "entity:%s:%s"
 
+    transient_attrs = {"cmd_pfx", "send", "_mutator", "population", "message_stats", "last_message_stats", "_listeners",
+                       "chunks", "chunk_loader", "gatekeepers"}
+    _state_fields = {}  # per class list of (attribute, key) pairs to persist, shared by all storages
+    _entity_subclasses = None  # every entity class, children and grand-children alike, shared by all storages
+    _serializers = {}  # type -> function serializing its instances, shared by all storages
+
     def __init__(self, send_callback_factory, cmd_pfx, redis=None, chatkey_type=None):
         self.send_callback_factory = send_callback_factory
         self.cmd_pfx = cmd_pfx
@@ -61,10 +118,10 @@ class Storage(RedisStorage):
         self.players = {}
         self.chatkeys = {}
 
-        self.entity_subclasses = [sc for c in self.entity_classes for sc in c.__subclasses__()]
-        self.entity_subclass_by_name = {sc.__name__: sc for sc in self.entity_subclasses}
-        self.entities = {classname: {} for classname in self.entity_subclass_by_name.keys()}
+        self.entity_subclasses, self.entity_subclass_by_name = self.get_entity_subclasses()
+        self.entities = defaultdict(dict)  # class name -> key -> entity
         self.entitykeys = {}
+        self.discarded_keys = set()  # deleted on save, together with everything else
 
         self.lock_object = self.redis.lock('global_lock', timeout=2)
         self.lock_object.acquire()
@@ -76,11 +133,39 @@ class Storage(RedisStorage):
             self.deserialize_state(world, eval(serialized_world))
         self.world = world
 
-        for location_id in Location.all.keys():
-            serialized = self.redis.get(self._location_key % location_id)
+        # the hand-built map is always loaded, generated regions only around active players or on demand
+        for location in world_map.locations:
+            serialized = self.redis.get(self._location_key % location.id)
+            if serialized is not None:
+                self.deserialize_state(self.world[location.id], eval(serialized))
+
+        world.chunk_loader = self.load_chunk
+        serialized_chunks = self.redis.get('active_chunks')
+        for chunk in eval(serialized_chunks) if serialized_chunks else ():
+            world.load_chunk(chunk)
+
+    def load_chunk(self, chunk):
+        """
+        Loads states of the locations of a chunk with a single MGET.
+        """
+        location_ids = Region.all[chunk[0]].get_chunk_location_ids(chunk)
+        serialized_states = self.redis.mget([self._location_key % location_id for location_id in location_ids])
+        for location_id, serialized in zip(location_ids, serialized_states):
             if serialized is not None:
                 self.deserialize_state(self.world[location_id], eval(serialized))
 
+    @classmethod
+    def get_entity_subclasses(cls):
+        """
+        Returns the list of entity classes in the order of dumping and the same classes by name, built once.
+        """
+        if Storage._entity_subclasses is None:
+            subclasses = []
+            for entity_class in cls.entity_classes:
+                subclasses.extend(sc for sc in all_subclasses(entity_class) if sc not in subclasses)
+            Storage._entity_subclasses = subclasses, {sc.__name__: sc for sc in subclasses}
+        return Storage._entity_subclasses
+
     def get_player_state(self, chatkey):
         chatkey = self.chatkey_type(chatkey)
         if chatkey in self.players:
@@ -129,22 +214,37 @@ class Storage(RedisStorage):
             yield self._location_key % location_id, self.serialize_state(state)
         for cls in self.entity_subclasses:
             classname = cls.__name__
-            for key, entity in self.entities[classname].items():
+            for key, entity in self.entities.get(classname, {}).items():
                 serialized = self.serialize_state(entity)
                 yield self._entity_key % (classname, key), serialized
 
+        for key in self.discarded_keys:
+            yield key, None
+        yield "active_chunks", sorted(self.world.get_active_chunks())
         yield "world", self.serialize_state(self.world)
         yield "version", self.version
 
     def release(self):
         self.lock_object.release()
 
-    def save(self):
+    def save(self, *sessions):
+        """
+        Writes everything in one pipeline, together with changes of player sessions if given, and starts or stops
+        the IdleClock.
+        """
+        pipeline = self.redis.pipeline()
         for k, v in self.dump():
             if v:
-                self.redis.set(k, repr(v))
+                pipeline.set(k, repr(v))
             else:
-                self.redis.delete(k)
+                pipeline.delete(k)
+        for session in sessions:
+            session.flush(pipeline)
+        if self.world.is_idle:
+            pipeline.setnx(IdleClock._idle_key, 0)
+        else:
+            pipeline.delete(IdleClock._idle_key)
+        pipeline.execute()
         self.release()
 
     def print_dump(self):
@@ -162,40 +262,67 @@ class Storage(RedisStorage):
                 setattr(state, k, o)
 
     def deserialize(self, v, perspective=None):
-        if isinstance(v, tuple):
-            cls, arg = v
-            if cls == 'Location':
-                return Location.all[arg]
-            elif cls == 'PlayerState':
-                return self.get_player_state(arg)
-            elif cls in {'ActorSet', 'CommoditySet'}:
-                iterable = self.deserialize(arg, perspective)
-                if cls == 'ActorSet':
-                    return ActorSet(iterable, perspective)
-                else:
-                    return eval(cls)(iterable)
-            else:
-                return self.get_entity_state(cls, arg)
-        elif isinstance(v, list):
-            return [self.deserialize(o, perspective) for o in v]
-        elif isinstance(v, dict):
-            deserialized = {}
-            for key, val in v.items():
-                deserialized[self.deserialize(key)] = self.deserialize(val, perspective)
-            return deserialized
-        else:
-            return v
+        deserializer = self._deserializers.get(type(v))
+        return v if deserializer is None else deserializer(self, v, perspective)
+
+    def _deserialize_ref(self, v, perspective):
+        cls, arg = v
+        deserializer = self._ref_deserializers.get(cls)
+        if deserializer is None:
+            return self.get_entity_state(cls, arg)
+        return deserializer(self, arg, perspective)
+
+    def _deserialize_list(self, v, perspective):
+        return [self.deserialize(o, perspective) for o in v]
+
+    def _deserialize_dict(self, v, perspective):
+        deserialized = {}
+        for key, val in v.items():
+            deserialized[self.deserialize(key)] = self.deserialize(val, perspective)
+        return deserialized
+
+    def _deserialize_stack(self, arg, perspective):
+        classname, count = arg
+        return self.entity_subclass_by_name[classname].stack(count)
+
+    _deserializers = {tuple: _deserialize_ref, list: _deserialize_list, dict: _deserialize_dict}
+    _ref_deserializers = {
+        'Location': lambda self, arg, perspective: Location.get(arg),
+        'PlayerState': lambda self, arg, perspective: self.get_player_state(arg),
+        'Stack': _deserialize_stack,
+        'ActorSet': lambda self, arg, perspective: ActorSet(self.deserialize(arg, perspective), perspective),
+        'CommoditySet': lambda self, arg, perspective: CommoditySet(self.deserialize(arg, perspective))}
+
+    @staticmethod
+    def _get_field_key(cls, attr):
+        if attr.startswith('_') and isinstance(getattr(cls, attr[1:], None), property):
+            return attr[1:]
+        return attr
+
+    @classmethod
+    def get_state_fields(cls, state_cls):
+        fields = cls._state_fields.get(state_cls)
+        if fields is None:
+            fields = []
+            transient_attrs = cls.transient_attrs | getattr(state_cls, 'transient_attrs', set())
+            for c in reversed(state_cls.__mro__):
+                slots = vars(c).get('__slots__', ())
+                for attr in (slots,) if isinstance(slots, str) else slots:
+                    if attr not in transient_attrs:
+                        fields.append((attr, cls._get_field_key(state_cls, attr)))
+            fields = cls._state_fields[state_cls] = tuple(fields)
+        return fields
 
     def serialize_state(self, state):
         serialized = {}
-        for k, o in vars(state).items():
-            if k == "cmd_pfx":
-                continue
+        fields = ((key, getattr(state, attr, None)) for attr, key in self.get_state_fields(type(state)))
+        if hasattr(state, '__dict__'):  # not every persisted class has __slots__
+            fields = chain(fields, ((self._get_field_key(type(state), k), o)
+                                    for k, o in vars(state).items() if k not in self.transient_attrs))
+        for k, o in fields:
             if isinstance(o, (dict, set)) and not o:
                 continue
             v = self.serialize(o)
-            if k.startswith('_') and isinstance(getattr(type(state), k[1:]), property):
-                k = k[1:]
             if v is not None and v is not False and v != 0:
                 serialized[k] = v
         return serialized
@@ -204,37 +331,44 @@ class Storage(RedisStorage):
         classname = entity.__class__.__name__
         key = self.entitykeys.get(entity, None)
         if key is None:
-            if self.entities[classname]:
-                key = max(0, max(self.entities[classname].keys())) + 1
-            else:
-                key = 1
+            key = max(max(self.entities[classname].keys(), default=0), self.world.entity_keys.get(classname, 0)) + 1
+            self.world.entity_keys[classname] = key
             self.entitykeys[entity] = key
             self.entities[classname][key] = entity
         return (classname, key)
 
     def serialize(self, o):
-        if isinstance(o, Location):
-            return ('Location', o.id)
-        elif isinstance(o, PlayerState):
-            return ('PlayerState', self.chatkeys[o])
-        elif isinstance(o, (ActorSet, CommoditySet)):
-            return (o.__class__.__name__, self.serialize(set(o)))
-        elif isinstance(o, self.entity_classes):
-            return self.serialize_entity(o)
-        elif isinstance(o, list):
-            return [self.serialize(x) for x in o]
-        elif isinstance(o, set):
-            return sorted(self.serialize(list(o)))
-        elif isinstance(o, dict):
-            serialized = {}
-            for k, v in o.items():
-                serialized[k] = self.serialize(v)
-            return serialized
-        elif isinstance(o, (str, int, float, bool)):
-            return o
-        elif o is None or callable(o):
-            return None
-        raise ValueError(o)
+        serializer = self._serializers.get(type(o))
+        if serializer is None:
+            serializer = self._serializers[type(o)] = self.get_serializer(type(o))
+        return serializer(self, o)
+
+    @classmethod
+    def get_serializer(cls, t):
+        """
+        Picks the function serializing instances of t, once per type.
+        """
+        if issubclass(t, Location):
+            return lambda self, o: ('Location', o.id)
+        elif issubclass(t, PlayerState):
+            return lambda self, o: ('PlayerState', self.chatkeys[o])
+        elif issubclass(t, (ActorSet, CommoditySet)):
+            return lambda self, o: (t.__name__, self.serialize(set(o)))
+        elif issubclass(t, Commodity) and t.fungible:
+            return lambda self, o: ('Stack', (t.__name__, o.count))
+        elif issubclass(t, cls.entity_classes):
+            return cls.serialize_entity
+        elif issubclass(t, list):
+            return lambda self, o: [self.serialize(x) for x in o]
+        elif issubclass(t, set):
+            return lambda self, o: sorted(self.serialize(list(o)))
+        elif issubclass(t, dict):
+            return lambda self, o: {k: self.serialize(v) for k, v in o.items()}
+        elif issubclass(t, (str, int, float, bool)):
+            return lambda self, o: o
+        elif t is type(None) or any('__call__' in vars(c) for c in t.__mro__):  # callbacks aren't persisted
+            return lambda self, o: None
+        raise ValueError(t)
 
     def all_players(self):
         keys = (key.split(b':', 1) for key in self.redis.keys(self._player_key % "*"))
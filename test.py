@@ -3,14 +3,22 @@
 import unittest
 import fnmatch
 import re
+import subprocess
+import sys
+from itertools import chain
+from os.path import dirname, abspath
 
-from storage import Storage
+from storage import Storage, PlayerSessionsStorage, IdleClock
 from migrate import migrations
-from mud.player import CommandPrefix
+from mud.player import CommandPrefix, ChoiceHandler, Chatflow, EatPlayerAction
+from mud.production import Land
 from mud.commodities import Vegetable, Mushroom, Cotton, Spindle, Shovel, DirtyRags, RoughspunTunic
-from mud.npcs import PeasantState, RatState
-from mud.locations import Direction, Field
+from mud.npcs import PeasantState, RatState, GuardMutator, PeasantMutator
+from mud.locations import Direction, Location, Field, TownGate, Woods, Forests, Village, VillageHouse, Slums, Wasteland, world_map
 from mud.attacks import Kick, Punch, Bash
+from mud.utils import digest
+from mud.world import SpawnRule, SpawnTable
+from mud import world
 
 
 class MockSendMessage(object):
@@ -49,10 +57,14 @@ class MockLockObject(object):
 class MockRedis(object):
     def __init__(self):
         self.dict = {}
+        self.expires = {}
 
     def get(self, key):
         return self.dict.get(key, None)
 
+    def mget(self, keys):
+        return [self.dict.get(key, None) for key in keys]
+
     def set(self, key, value):
         self.dict[key] = value
 
@@ -67,6 +79,42 @@ class MockRedis(object):
         if key in self.dict:
             del self.dict[key]
 
+    def hgetall(self, key):
+        return {k.encode(): str(v).encode() for k, v in self.dict.get(key, {}).items()}
+
+    def hmset(self, key, mapping):
+        self.dict.setdefault(key, {}).update(mapping)
+
+    def expire(self, key, seconds):
+        self.expires[key] = seconds
+
+    def incr(self, key):
+        self.dict[key] = int(self.dict.get(key, 0)) + 1
+        return self.dict[key]
+
+    def setnx(self, key, value):
+        if key not in self.dict:
+            self.dict[key] = value
+
+    def eval(self, script, numkeys, *keys_and_args):
+        return self.scripts[script](self, *keys_and_args)
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+MockRedis.scripts = {  # Lua scripts emulated by the commands they call
+    IdleClock._incr_if_idle: lambda redis, key: redis.incr(key) if key in redis.dict else None,
+}
+
+
+class GiantRatState(RatState):  # a grand-child of NpcState
+    __slots__ = ()
+    abstract_name = 'a giant rat'
+
 
 class ChatflowTestCase(unittest.TestCase):
     @classmethod
@@ -185,8 +233,12 @@ class ChatflowTestCase(unittest.TestCase):
         self.chatflow.location.items.add(Mushroom())
         self.send("#pick")
         self.chatflow.location.items.remove(veg)  # someone took it
-        self.send(self.get_option("vegetable"))
-        self.assertReplyContains("You put nothing")
+        option = self.get_option("vegetable")
+        self.messages.reset()
+        self.send(option)
+        self.assertReplyContains("Please choose what to pick")  # the choice is stale, so choose again
+        self.assertFalse(veg in self.player.bag)
+        self.send("#cancel")
         self.chatflow.location.items.clear()
         self.player.bag.clear()
 
@@ -480,6 +532,504 @@ class ChatflowTestCase(unittest.TestCase):
         self.assertIsNone(self.player.victim)
         self.assertIsNone(rat.victim)
 
+    def test_12_stacks(self):
+        self.chatflow.location.items.clear()
+        self.player.bag.clear()
+        self.player.bag.update(Vegetable() for _ in range(5))
+        self.assertEqual(len(self.player.bag), 5)
+        self.assertEqual(len(set(self.player.bag)), 1)
+
+        self.send('#eat')
+        self.send(self.get_option('5 vegetables'))
+        self.assertEqual(self.player.bag.count(Vegetable), 4)
+
+        self.send('#drop')
+        self.send(self.get_option('4 vegetables'))
+        self.assertReplyContains('You drop .*a vegetable on the ground')
+        self.assertEqual(self.player.bag.count(Vegetable), 3)
+
+        self.chatflow.location.items.add(Vegetable())
+        self.send('#collect')
+        self.assertReplyContains('2 vegetables')
+        self.assertEqual(self.player.bag.count(Vegetable), 5)
+        self.assertFalse(self.chatflow.location.items)
+
+        self.storage.save()
+        player = self.get_storage().get_player_state(0)
+        self.assertEqual(player.bag.count(Vegetable), 5)
+        self.assertFalse(any(k.startswith('entity:Vegetable') for k in self.redis.dict))
+
+    def test_13_choice_input(self):
+        self.send('#eat #1')
+        self.assertReplyContains('You eat')
+        self.assertNotIn('choices', self.player.input)
+
+        self.player.bag.add(Mushroom())
+        self.send('#eat')
+        self.assertEqual(self.player.input['choices'], ['Mushroom:🍄 a mushroom', 'Vegetable:🥕 a vegetable'])
+        self.send(self.get_option('vegetables'))
+        self.assertEqual(self.player.bag.count(Vegetable), 3)
+
+        # a choice that's gone from the bag brings up the menu again
+        self.send('#eat')
+        option = self.get_option('mushroom')
+        self.player.bag.discard(next(self.player.bag.filter(Mushroom)))
+        self.messages.reset()
+        self.send(option)
+        self.assertReplyContains('Please choose')
+        self.assertEqual(self.player.bag.count(Vegetable), 3)
+        self.send('#cancel')
+
+    def test_14_choice_pages(self):
+        self.player.bag.update([Mushroom(), Cotton(), Spindle()])
+        ChoiceHandler.page_size = 2
+        try:
+            self.send('#drop')
+            reply = "\n".join(self.messages)
+            self.assertIn('Page 1 of 2', reply)
+            self.assertRegex(reply, '#1. .* cotton')
+            self.assertNotIn('#3.', reply)
+
+            self.send('#next')
+            reply = "\n".join(self.messages)
+            self.assertIn('#3. 🌀 a spindle', reply)
+            self.assertNotIn('#1.', reply)
+
+            self.send('#1')  # not on this page
+            self.assertReplyContains('Page 2 of 2')
+
+            self.send('#prev')
+            self.assertReplyContains('#1. .* cotton')
+
+            self.send('A MUSH')
+            reply = "\n".join(self.messages)
+            self.assertIn('#1. 🍄 a mushroom', reply)
+            self.assertNotIn('Page', reply)
+            self.send('#1')
+            self.assertReplyContains('You drop 🍄 a mushroom')
+            self.assertEqual(self.player.bag.count(Mushroom), 0)
+
+            self.send('#drop')
+            self.send('nails')
+            self.assertReplyContains('Nothing matches "nails"')
+            self.send('#cancel')
+        finally:
+            ChoiceHandler.page_size = 10
+
+    def test_15_player_session(self):
+        session = PlayerSessionsStorage(redis=self.redis, ttl=60).get_session(0)
+        self.assertIsNone(session.get('category'))
+        session.set('category', 'inventory')
+        session.set('keyboard', 'abc')
+        self.assertEqual(session.get('category'), 'inventory')
+        self.assertNotIn('player_session:0', self.redis.dict)
+
+        self.storage.save(session)
+        self.assertEqual(self.redis.expires['player_session:0'], 60)
+        session = PlayerSessionsStorage(redis=self.redis).get_session(0)
+        self.assertEqual(session.get('category'), 'inventory')
+        self.assertEqual(session.get('keyboard'), 'abc')
+        session.flush()
+        self.assertEqual(session.changed, {})
+
+        del self.redis.expires['player_session:0']
+        session = PlayerSessionsStorage(redis=self.redis, ttl=60).get_session(0)
+        self.assertEqual(session.get('category'), 'inventory')
+        self.storage.save(session)
+        self.assertEqual(self.redis.expires['player_session:0'], 60)  # reading keeps the session alive
+
+    def test_16_command_sequence(self):
+        self.chatflow._relocate_self(Field)
+        self.send('#north; #south;#north')
+        self.assertReplyContains('village', 'field')
+        self.assertIsNot(self.player.location, Field)
+
+        self.send('#south; #nowhere; #north')
+        self.assertReplyContains('Unknown command')
+        self.assertIs(self.player.location, Field)
+
+        self.send('#exit; #north')  # there's no exit from the field
+        self.assertReplyContains("can't exit here")
+        self.assertIs(self.player.location, Field)
+
+        self.player.bag.update([Mushroom(), Cotton()])
+        self.send('#drop; #north')  # waits for a choice
+        self.assertReplyContains('Please choose')
+        self.assertIs(self.player.location, Field)
+        self.send('#cancel')
+
+        location = self.chatflow.location
+        barterers = [actor for actor in location.actors if actor.barters]
+        for actor in barterers:
+            location.actors.remove(actor)
+        self.send('#barter; #north')  # the choice of whom to barter with is aborted
+        self.assertReplyContains("no one here you can barter with")
+        self.assertIs(self.player.location, Field)
+        location.actors.update(barterers)
+
+    def test_17_routine(self):
+        for location in self.world.values():
+            for rat in list(location.actors.filter(RatState)):
+                location.actors.remove(rat)
+
+        self.send('#farm x3')
+        self.assertReplyContains('You start to farm')
+        self.world.enact()
+        self.assertEqual(self.player.routine['done'], 1)
+
+        self.storage.save()  # the routine survives a reload
+        self.setUp()
+        self.assertEqual(self.player.routine['done'], 1)
+        self.assertTrue(self.player.routine['produced'])
+        self.cycle(self.world.enact, lambda: not self.player.routine, "Routine isn't done", max_cycles=5)
+        self.assertReplyContains('You farm 3 times and get')
+
+        until = self.player.bag.count(Vegetable) + 2
+        self.send(f'#farm until {until} vegetables')
+        self.cycle(self.world.enact, lambda: not self.player.routine, "Routine isn't done")
+        self.assertGreaterEqual(self.player.bag.count(Vegetable), until)
+
+        self.send('#farm until 5 spindles')  # farming never yields spindles
+        self.assertReplyContains("You can't farm .*spindle")
+        self.assertFalse(self.player.routine)
+        self.send('#farm until 2 sets')  # dirty rags or overalls
+        self.assertReplyContains('Which one do you mean')
+        self.assertFalse(self.player.routine)
+        self.send('#farm x0')  # would never be done
+        self.assertReplyContains('You can #farm x10')
+        self.assertFalse(self.player.routine)
+
+        self.send('#farm x50')
+        self.world.enact()
+        self.send('#north')
+        self.messages.reset()
+        self.world.enact()
+        self.assertReplyContains("You can't farm anymore. You farm once and get")
+        self.assertFalse(self.player.routine)
+        self.send('#south')
+
+    def test_18_lazy_announces(self):
+        stats = self.world.message_stats
+        stats.clear()
+        rat = RatState()
+        rat.get_mutator(self.world).spawn(next(iter(Woods.values())))  # nobody's there to see it
+        self.assertEqual(stats, {'suppressed': 1})
+        rat.get_mutator(self.world).die()
+        stats.clear()
+
+        rat = RatState()
+        rat.get_mutator(self.world).spawn(Field)
+        self.assertEqual(stats, {'formatted': 1})
+        self.assertReplyContains('rat materializes')
+        rat.get_mutator(self.world).die()
+
+    def test_19_listeners(self):
+        field = self.chatflow.location
+        self.assertEqual(field.listeners, {self.player})
+        self.send('#north')
+        self.assertNotIn(self.player, field.listeners)
+        self.assertIn(self.player, self.chatflow.location.listeners)
+        self.send('#south')
+        self.assertIn(self.player, field.listeners)
+
+        self.player.cooldown['active'] = 0
+        self.chatflow.act()  # falls asleep
+        self.assertFalse(field.listeners)
+        self.send('#where')
+        self.assertIn(self.player, field.listeners)
+
+    def test_20_digest(self):
+        rat = RatState()
+        mutator = rat.get_mutator(self.world)
+        mutator.spawn(Field)
+        woods = Field.exits['south']['location']
+        mutator._relocate_self(woods)
+        mutator._relocate_self(Field)
+        mutator._relocate_self(woods)
+        messages = list(digest(self.messages))
+        self.assertEqual(messages, ['🐀 A rat materializes.', '🐀 A rat leaves to woods.'])
+
+        other = RatState()
+        other_mutator = other.get_mutator(self.world)
+        other_mutator.spawn(woods)
+        other_mutator._relocate_self(Field)  # another rat comes from where the first one went
+        messages = list(digest(self.messages))
+        self.assertEqual(messages, ['🐀 A rat arrives from woods.'])
+        mutator._relocate_self(Field)
+        other_mutator._relocate_self(woods)
+        messages = list(digest(self.messages))
+        self.assertEqual(messages, ['🐀 A rat arrives from woods.', '🐀 A rat leaves to woods.'])
+        mutator.die()
+        other_mutator.die()
+
+    def test_21_hibernation(self):
+        self.player.cooldown['active'] = 0
+        self.world.enact()
+        self.assertIn('asleep', self.player.cooldown)
+        self.player.cooldown['asleep'] = 0
+        self.world.enact()
+        self.assertIs(self.player.location, Field)
+        self.assertNotIn(self.player, self.chatflow.location.actors)
+        self.assertNotIn(self.player, set(self.world.actors()))
+        self.assertEqual(self.world.sleeping, {Field.id: 1})
+
+        self.storage.save()
+        self.assertNotIn(('PlayerState', 0), eval(self.redis.get(Storage._location_key % Field.id))['actors'])
+        self.setUp()
+        self.send('#where')
+        self.assertIn(self.player, self.chatflow.location.actors)
+        self.assertFalse(self.world.sleeping)
+        self.assertNotIn('asleep', self.player.cooldown)
+
+        other = self.storage.get_player_state(2)
+        other.name = 'Sleepy'
+        other_mutator = other.get_mutator(self.world)
+        other_mutator.spawn(Field)
+        other.cooldown.clear()
+        other_mutator.hibernate()
+        self.send('#where')
+        self.assertReplyContains('Someone is sleeping here')
+        other_mutator.process_message('#where')
+        self.assertFalse(self.world.sleeping)
+
+    def test_22_idle_world(self):
+        clock = IdleClock(redis=self.redis)
+        self.storage.save()
+        self.assertFalse(clock.skip_tick(3))
+
+        for player in self.storage.players.values():
+            player.cooldown.pop('active', None)
+            player.get_mutator(self.world).update_listening()
+        self.assertTrue(self.world.is_idle)
+        self.storage.save()
+        self.assertEqual([clock.skip_tick(3) for _ in range(6)], [True, True, False, True, True, False])
+
+        self.setUp()
+        self.send('#where')
+        self.storage.save()
+        self.assertFalse(clock.skip_tick(3))
+        self.assertNotIn(IdleClock._idle_key, self.redis.dict)  # not brought back by the tick
+
+        self.send('#farm x100')
+        self.player.cooldown.pop('active', None)
+        self.chatflow.update_listening()
+        self.assertFalse(self.world.is_idle)  # the routine goes on
+        self.send('#farm stop')
+
+    def test_23_world_map(self):
+        self.assertEqual(world_map.route(Field, VillageHouse), 'north')
+        self.assertEqual(world_map.route(Village, VillageHouse), 'enter')
+        self.assertEqual(world_map.route(VillageHouse, Field), 'exit')
+        self.assertEqual(world_map.route(Woods['south'], Slums), 'north')
+        self.assertIsNone(world_map.route(Field, Field))
+        self.assertIsNone(world_map.route(Forests['north'], Field))  # only magic exits lead out of a forest
+
+        for _ in range(100):
+            location = Forests['south'].exits['south']['location']
+            self.assertNotIn(location, (Woods['south'], Field))
+
+    def test_24_region(self):
+        gate = Slums.exits['south']['location']
+        self.assertEqual(gate.exits['north']['location'], Slums)
+        self.assertEqual(gate.chunk, ('wasteland', 0, 7))
+        self.assertEqual(sum(1 for location in Location.all.values() if location.chunk == gate.chunk), 64)
+        self.assertNotIn(Wasteland.get_id(40, 40), Location.all)
+        self.assertIsNone(world_map.route(gate, Slums))  # generated locations aren't on the world map
+        self.assertIsNone(world_map.route(Slums, gate))
+
+        far = Location.get(Wasteland.get_id(40, 40))
+        self.world[far.id].items.add(Mushroom())
+        self.chatflow._relocate_self(gate)
+        self.storage.save()
+        self.assertEqual(eval(self.redis.get('active_chunks')), [('wasteland', 0, 6), ('wasteland', 0, 7),
+                                                                 ('wasteland', 1, 6), ('wasteland', 1, 7)])
+
+        self.setUp()
+        self.assertEqual(self.world.chunks, {('wasteland', 0, 6), ('wasteland', 0, 7),
+                                             ('wasteland', 1, 6), ('wasteland', 1, 7)})
+        self.assertIn(self.player, self.world[gate.id].actors)
+        self.assertTrue(any(self.world[far.id].items.filter(Mushroom)))
+        self.assertIn(far.chunk, self.world.chunks)
+
+        self.send('#north')
+        self.assertIs(self.player.location, Slums)
+        self.chatflow._relocate_self(Field)
+
+    def test_25_static_text(self):
+        sentences = Field.get_exits_descr(self.cmd_pfx)
+        self.assertIs(Field.get_exits_descr(self.cmd_pfx), sentences)
+        self.assertIn('To the #north you see a road leading to a village.', sentences)
+        self.assertEqual(Field.get_exits_descr(CommandPrefix('/'))[0], 'To the /north you see a road leading to a village.')
+        self.assertEqual(Land.get_descr(self.cmd_pfx), 'The land seems arable to #farm.')
+
+        self.send('#where')
+        self.assertReplyContains('The land seems arable to #farm', 'To the #west, #south and #east you see woods')
+
+    def test_26_location_views(self):
+        def fail():
+            raise AssertionError('The view is rendered again')
+
+        location = self.chatflow.location
+        self.send('#where')
+        version = location.version
+        key = ('actors', self.player.get_uid())
+        self.assertIsNotNone(version)
+        self.send('#where')
+        self.assertEqual(location.version, version)
+
+        self.storage.save()  # the version is saved, so the next request reuses views of this one
+        self.setUp()
+        location = self.chatflow.location
+        self.assertEqual(location.version, version)
+        location.get_view(self.player.location.id, key, fail)
+
+        location.items.add(Mushroom())
+        self.assertNotEqual(location.version, version)
+        self.send('#where')
+        self.assertReplyContains('On the ground you see .*mushroom')
+
+        rat = RatState()
+        rat.get_mutator(self.world).spawn(Field)
+        version = location.version
+        rat.get_mutator(self.world).attack(self.player)
+        self.assertNotEqual(location.version, version)
+        self.send('#where')
+        self.assertReplyContains('rat attacking you')
+        rat.get_mutator(self.world).die()
+
+    def test_27_mutator_metadata(self):
+        self.assertIn('active', Chatflow.cooldown_announces)
+        self.assertIn('high', EatPlayerAction.cooldown_announces)
+        self.assertTrue(GuardMutator.is_gatekeeper)
+        self.assertFalse(PeasantMutator.is_gatekeeper)
+        self.assertFalse(Chatflow.is_gatekeeper)
+        self.assertIn('eat', Chatflow.get_action_classes())
+        self.assertIn('farm', Chatflow.get_action_classes())
+
+        guard, = self.world[TownGate.id].gatekeepers
+        self.assertIs(guard.mutator_class, GuardMutator)
+        self.assertFalse(self.world[Field.id].gatekeepers)
+
+    def test_28_schema(self):
+        entity_subclasses, entity_subclass_by_name = Storage.get_entity_subclasses()
+        self.assertIs(entity_subclass_by_name['GiantRatState'], GiantRatState)
+        self.assertLess(entity_subclasses.index(GiantRatState), entity_subclasses.index(Vegetable))
+
+        rat = GiantRatState()
+        rat.get_mutator(self.world).spawn(Woods['south'])
+        self.storage.save()
+        self.setUp()
+        rat, = self.world[Woods['south'].id].actors.filter(GiantRatState)
+        self.assertEqual(rat.name, '🐀 a giant rat')
+        self.assertIs(rat.location, Woods['south'])
+        rat.get_mutator(self.world).die()
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime is there since Python 3.7")
+    def test_29_import_time(self):
+        budget = 500000  # us
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                                cwd=dirname(abspath(__file__)), stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        imported = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:'):
+                self_us, cumulative_us, name = line[len('import time:'):].split('|')
+                if cumulative_us.strip().isdigit():  # not the header
+                    imported[name.strip()] = int(cumulative_us)
+
+        self.assertLess(imported['app'], budget)
+        for module in ('telegram', 'flask', 'deepdiff'):
+            self.assertNotIn(module, imported)
+
+    def test_30_migration_deletes_on_save(self):
+        redis = MockRedis()
+        key = Storage._entity_key % ('Vegetable', 1)
+        redis.set(key, repr({'count': 1}))
+        storage = Storage(self.messages.send_callback_factory, redis=redis, cmd_pfx=self.cmd_pfx)
+        migrate_10, = (m for m in migrations if m.__name__ == 'migrate_10')
+        migrate_10(storage)
+        self.assertIsNotNone(redis.get(key))  # a dry run doesn't save
+        storage.save()
+        self.assertIsNone(redis.get(key))
+
+    def test_31_spawn_rules(self):
+        self.assertRaises(Exception, SpawnTable, SpawnRule(Mushroom, Forests.values()), SpawnRule(Mushroom, Woods.values()))
+
+        table = SpawnTable(
+            SpawnRule(Mushroom, Forests.values(), name='forest mushrooms', max_population=2),
+            SpawnRule(Mushroom, chain([Field], Woods.values()), name='woods mushrooms', max_population=2))
+        saved_table, world.spawn_table = world.spawn_table, table
+        try:
+            state = world.WorldState()
+            state[Forests['north'].id].items.add(Mushroom())
+            state[Woods['south'].id].items.add(Mushroom())
+            state[Field.id].items.add(Mushroom())
+            self.assertEqual(state.population, {'forest mushrooms': 1, 'woods mushrooms': 2})
+
+            for rule in table:
+                rule.apply(state)
+            self.assertEqual(state.spawned, {'forest mushrooms': 0})
+            self.assertEqual(state.population['forest mushrooms'], 2)
+        finally:
+            world.spawn_table = saved_table
+
+    def test_32_choose_between_namesakes(self):
+        for _ in range(2):
+            RatState().get_mutator(self.world).spawn(Field)
+        self.send('#where')
+        self.storage.save()
+
+        victims = []
+        for i in range(2):
+            self.setUp()
+            self.player.victim = None
+            self.send('#attack')
+            options = [line[:2] for line in "\n".join(self.messages).split("\n") if line.startswith('#') and line.endswith('a rat')]
+            self.assertGreaterEqual(len(options), 2)
+            self.storage.save()
+
+            self.setUp()
+            self.send(options[i])
+            self.assertIsInstance(self.player.victim, RatState)
+            victims.append(self.player.victim.uid)
+            self.storage.save()
+        self.assertNotEqual(*victims)
+
+        self.player.victim = None
+        for rat in list(self.chatflow.location.actors.filter(RatState)):
+            rat.get_mutator(self.world).die()
+
+    def test_33_routine_outlasts_hibernation(self):
+        for location in self.world.values():
+            for rat in list(location.actors.filter(RatState)):
+                location.actors.remove(rat)
+
+        self.send('#farm x5')
+        self.player.cooldown['active'] = 0
+        self.world.enact()  # falls asleep
+        self.assertNotIn('active', self.player.cooldown)
+        self.player.cooldown['asleep'] = 0
+        self.world.enact()  # isn't hibernated while farming
+        self.assertIn(self.player, self.chatflow.location.actors)
+        self.assertFalse(self.world.sleeping)
+
+        self.messages.reset()
+        self.cycle(self.world.enact, lambda: not self.player.routine, "Routine isn't done")
+        self.assertReplyContains('You farm 5 times and get')
+        self.world.enact()
+        self.world.enact()
+        self.assertNotIn(self.player, self.chatflow.location.actors)
+        self.assertEqual(self.world.sleeping, {Field.id: 1})
+        self.send('#where')
+        self.assertIn(self.player, self.chatflow.location.actors)
+
+    def test_34_unstacked_commodities_have_no_count(self):
+        spindle = Spindle()
+        spindle.usages = 2
+        self.assertEqual(self.storage.serialize_state(spindle), {'usages': 2})
+        self.assertEqual(self.storage.serialize(Vegetable.stack(3)), ('Stack', ('Vegetable', 3)))
+
 
 def load_tests(loader, tests, pattern):
     suite = unittest.TestLoader().loadTestsFromTestCase(ChatflowTestCase)